@@ -4,11 +4,22 @@ import nextcord
 import nextcord.ui
 from nextcord.ext import commands
 import asyncio
+import concurrent.futures
+import copy
+import ctypes.util
+import hashlib
+import json
+import os
 import yt_dlp
 import logging
-import functools
-from collections import deque
-from typing import TYPE_CHECKING, Union, Optional, List # Added List
+import re
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import TYPE_CHECKING, Union, Optional, List, AsyncIterator # Added List
+from ..utils import history as redis_utils
 
 # --- Type Hinting Forward Reference ---
 if TYPE_CHECKING:
@@ -21,10 +32,72 @@ if TYPE_CHECKING:
 # --- Suppress Noise/Info from yt-dlp ---
 yt_dlp.utils.bug_reports_message = lambda: ''
 
+# Configure Logger
+logger = logging.getLogger(__name__)
+_LOG_LEVEL = os.getenv('MUSIC_LOG_LEVEL', 'INFO').upper() # Set MUSIC_LOG_LEVEL=DEBUG for verbose playback/extraction tracing
+try:
+    logger.setLevel(_LOG_LEVEL)
+except ValueError: # Unknown level name; a config typo shouldn't take down the cog
+    logger.setLevel(logging.INFO)
+    logger.warning("Unknown MUSIC_LOG_LEVEL %r; using INFO.", _LOG_LEVEL)
+
 # --- FFmpeg Options ---
 FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
 FFMPEG_OPTIONS = '-vn'
 
+# --- Opus Library ---
+# Fallback libopus locations for this platform, tried if the linker cache has no match
+OPUS_PATHS = {
+    'linux': ( # Debian multiarch, as installed by the Dockerfile
+        '/usr/lib/x86_64-linux-gnu/libopus.so.0',
+        '/usr/lib/aarch64-linux-gnu/libopus.so.0',
+    ),
+    'darwin': ( # Homebrew on Apple Silicon / Intel
+        '/opt/homebrew/lib/libopus.dylib',
+        '/usr/local/lib/libopus.dylib',
+    ),
+    'win32': ( # DLL bundled with nextcord; it only loads it itself on first encode, after setup() has checked
+        os.path.join(os.path.dirname(nextcord.opus.__file__), 'bin', f"libopus-0.{'x64' if sys.maxsize > 2**32 else 'x86'}.dll"),
+    ),
+}.get(sys.platform, ())
+
+# --- Extraction Options ---
+MAX_CONCURRENT_EXTRACTIONS = 4 # yt-dlp calls allowed to run at once across all guilds
+# Recent yt-dlp results are reused for repeat queries; stream URLs stay valid far longer than the TTL
+INFO_CACHE_TTL = 600.0
+INFO_CACHE_ERROR_TTL = 30.0 # Failed lookups are remembered briefly so a dead URL isn't hammered
+INFO_CACHE_SIZE = 128
+# Successful results are also kept in Redis so they survive restarts, until the first signed stream URL in them expires
+INFO_CACHE_PERSIST_TTL = 3600.0 # Upper bound, also used for results without stream URLs (e.g. flat playlists)
+INFO_CACHE_PERSIST_TIMEOUT = 1.0 # Give up on Redis quickly so an outage can't stall a lookup
+# yt-dlp's own disk cache (YouTube player JS, signature functions), shared by every lookup this process makes
+YTDL_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'baconflip-ytdl-cache')
+
+# --- Playback Options ---
+def _idle_timeout_from_env(default: float = 300.0) -> Optional[float]:
+    """Reads MUSIC_IDLE_TIMEOUT, falling back to the default on a malformed or negative value instead of failing the import."""
+    raw = os.getenv('MUSIC_IDLE_TIMEOUT')
+    if raw is None: return default
+    try:
+        timeout = float(raw)
+    except ValueError:
+        timeout = -1.0
+    if not timeout >= 0: # Also rejects NaN
+        logger.warning("Invalid MUSIC_IDLE_TIMEOUT %r; using %.0fs.", raw, default)
+        return default
+    return timeout or None
+
+# Seconds to wait on an empty queue before leaving voice; 0 disables the timeout
+IDLE_TIMEOUT: Optional[float] = _idle_timeout_from_env()
+# Minimum seconds between "Music Error" messages per guild, so a bad stream can't flood the channel
+ERROR_NOTICE_INTERVAL = 5.0
+# Seconds to collect feedback embeds for the same user before sending them as one DM
+FEEDBACK_BATCH_WINDOW = 0.25
+# Seconds in which a repeated ?queue in the same channel, with nothing changed, is answered with a reaction instead of a new embed
+QUEUE_REPEAT_WINDOW = 2.0
+MAX_EMBEDS_PER_MESSAGE = 10 # Discord limit
+MAX_MESSAGE_LENGTH = 2000 # Discord limit
+
 # --- YTDL Options ---
 YDL_OPTS = {
     'format': 'bestaudio/best',
@@ -39,57 +112,208 @@ YDL_OPTS = {
     'default_search': 'auto',
     'source_address': '0.0.0.0',  # Bind to all interfaces to avoid potential issues
     'extract_flat': 'in_playlist', # Faster playlist extraction, get individual URLs later if needed
-    'force_generic_extractor': True, # Sometimes helps with problematic URLs
+    'cachedir': YTDL_CACHE_DIR,   # Reuse downloaded player JS instead of fetching it per lookup
 }
 
-# Configure Logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG) # Set to INFO for less verbose logging in production
+# Single-video variant: fully processes one URL in a single extract_info call
+YDL_OPTS_SINGLE = {**YDL_OPTS, 'noplaylist': True, 'extract_flat': False}
+
+# Direct YouTube video links (no playlist attached) skip the flat playlist probe
+_YT_VIDEO_RE = re.compile(
+    r'^(?:https?://)?(?:www\.|m\.|music\.)?(?:youtube\.com/(?:watch\?v=|shorts/)|youtu\.be/)[\w-]{11}(?![\w-])(?!.*[?&]list=)'
+)
+
+class ExtractionError(str, Enum):
+    """Failure codes returned by MusicCog._extract_info."""
+    NODATA = 'nodata'
+    PLAYLIST_EMPTY_OR_FAIL = 'playlist_empty_or_fail'
+    PROCESS_SINGLE_FAILED = 'process_single_failed'
+    UNSUPPORTED = 'unsupported'
+    UNAVAILABLE = 'unavailable'
+    PRIVATE = 'private'
+    AGE_RESTRICTED = 'age_restricted'
+    EXTRACT_FAILED = 'extract_failed'
+    NETWORK = 'network'
+    DOWNLOAD_GENERIC = 'download_generic'
+    EXTRACTION_UNEXPECTED = 'extraction_unexpected'
+    INTERNAL_EXTRACT = 'internal_extract'
+
+# yt-dlp DownloadError classification: substrings of the lowercased message, in priority order (first match wins)
+_YTDL_ERROR_MARKERS = (
+    ('unsupported url', ExtractionError.UNSUPPORTED),
+    ('video unavailable', ExtractionError.UNAVAILABLE),
+    ('private video', ExtractionError.PRIVATE),
+    ('age restricted', ExtractionError.AGE_RESTRICTED),
+    ('could not extract', ExtractionError.EXTRACT_FAILED),
+    ('network error', ExtractionError.NETWORK),
+    ('webpage', ExtractionError.NETWORK),
+)
+
+# User-facing messages for each ExtractionError
+_EXTRACTION_ERROR_MESSAGES = {
+    ExtractionError.NODATA: "Could not find any data for your query.",
+    ExtractionError.PLAYLIST_EMPTY_OR_FAIL: "Could not add any songs from the playlist. They might be unavailable or private.",
+    ExtractionError.PROCESS_SINGLE_FAILED: "Failed to process the requested track. It might be unsupported or unavailable.",
+    ExtractionError.UNSUPPORTED: "This URL or video format is not supported.",
+    ExtractionError.UNAVAILABLE: "This video is unavailable.", ExtractionError.PRIVATE: "This video is private.",
+    ExtractionError.AGE_RESTRICTED: "This video is age-restricted.", ExtractionError.EXTRACT_FAILED: "Failed to extract information for this item.",
+    ExtractionError.NETWORK: "A network error occurred while fetching information.", ExtractionError.DOWNLOAD_GENERIC: "An error occurred while trying to access the media.",
+    ExtractionError.EXTRACTION_UNEXPECTED: "An unexpected error occurred during information extraction.",
+    ExtractionError.INTERNAL_EXTRACT: "An internal error occurred while processing your request."
+}
+
+# Fallback DM for commands that raised an unexpected exception (formatted with the command name)
+_GENERIC_INVOKE_MSG = "An internal error occurred while running the `{}` command. Please let the bot owner know."
+
+# Expiry timestamp embedded in signed stream URLs (googlevideo uses both query and path forms)
+_STREAM_EXPIRE_RE = re.compile(r'[?&/]expire[=/](\d+)')
 
 # --- DM Helper ---
-async def _send_dm_or_log(user: nextcord.Member, message: Optional[str] = None, embed: Optional[nextcord.Embed] = None):
+async def _send_dm_or_log(user: nextcord.Member, message: Optional[str] = None, embed: Optional[nextcord.Embed] = None,
+                          embeds: Optional[List[nextcord.Embed]] = None):
     """Attempts to send a DM, logs failure."""
     if not user:
         logger.warning("Attempted to send DM but user object was None.")
         return
     try:
-        if message or embed: # Ensure there's something to send
-            await user.send(content=message, embed=embed)
-            logger.debug(f"Sent DM to {user.name} ({user.id}).")
+        if message or embed or embeds: # Ensure there's something to send
+            await user.send(content=message, embed=embed, embeds=embeds)
+            logger.debug("Sent DM to %s (%s).", user.name, user.id)
     except nextcord.Forbidden:
-        logger.warning(f"Could not send DM to {user.name} ({user.id}). DMs might be disabled or bot blocked.")
+        logger.warning("Could not send DM to %s (%s). DMs might be disabled or bot blocked.", user.name, user.id)
     except nextcord.HTTPException as e:
-        logger.error(f"HTTP error sending DM to {user.name} ({user.id}): {e}")
+        logger.error("HTTP error sending DM to %s (%s): %s", user.name, user.id, e)
     except Exception as e:
-        logger.error(f"Unexpected error sending DM to {user.name} ({user.id}): {e}", exc_info=True)
+        logger.error("Unexpected error sending DM to %s (%s): %s", user.name, user.id, e, exc_info=True)
+
+# --- Feedback Batching ---
+class FeedbackBatcher:
+    """Coalesces feedback embeds and messages queued for the same user within a short window into one DM."""
+    def __init__(self, window: float = FEEDBACK_BATCH_WINDOW):
+        self.window: float = window
+        self._pending: dict[int, tuple[List[nextcord.Embed], List[str]]] = {}
+        self._flush_tasks: dict[int, asyncio.Task] = {}
+
+    def add(self, user: nextcord.Member, embed: Optional[nextcord.Embed] = None, message: Optional[str] = None):
+        """Queues an embed and/or message line for the user; everything queued within the window is sent together."""
+        embeds, messages = self._pending.setdefault(user.id, ([], []))
+        if embed: embeds.append(embed)
+        if message: messages.append(message)
+        if user.id not in self._flush_tasks:
+            self._flush_tasks[user.id] = asyncio.get_event_loop().create_task(self._flush_after_window(user))
+
+    async def _flush_after_window(self, user: nextcord.Member):
+        await asyncio.sleep(self.window)
+        self._flush_tasks.pop(user.id, None)
+        embeds, messages = self._pending.pop(user.id, ([], []))
+        if len(embeds) + len(messages) > 1:
+            logger.debug("Coalesced %d feedback embeds and %d messages for %s (%s).", len(embeds), len(messages), user.name, user.id)
+        content = "\n".join(dict.fromkeys(messages))[:MAX_MESSAGE_LENGTH] or None # Repeats of the same error collapse into one line
+        for i in range(0, max(len(embeds), 1), MAX_EMBEDS_PER_MESSAGE):
+            await _send_dm_or_log(user, message=content if i == 0 else None, embeds=embeds[i:i + MAX_EMBEDS_PER_MESSAGE] or None)
+
+    def close(self):
+        """Cancels pending flushes and drops their embeds."""
+        for task in self._flush_tasks.values():
+            task.cancel()
+        self._flush_tasks.clear()
+        self._pending.clear()
+
+# --- Entry Helpers ---
+def _is_flat_entry(entry: dict) -> bool:
+    """True for extract_flat playlist entries that still need a full extraction to be playable."""
+    return entry.get('_type') == 'url' and 'url' in entry and 'formats' not in entry and 'entries' not in entry
+
+def _to_int_duration(duration) -> Optional[int]:
+    try: return int(duration) if duration is not None else None
+    except (ValueError, TypeError): return None
+
+# Format picks in priority order: preferred audio-only codecs, then yt-dlp's 'bestaudio', then any audio-only, then anything with audio
+_AUDIO_CODEC_PREFERENCE = ('opus', 'aac', 'vorbis', 'mp4a', 'mp3')
+_AUDIO_FORMAT_TIERS = _AUDIO_CODEC_PREFERENCE + ('bestaudio', 'audio-only', 'any')
+_AUDIO_FORMAT_RANK = {tier: rank for rank, tier in enumerate(_AUDIO_FORMAT_TIERS)}
+
+def _audio_format_tier(f: dict) -> Optional[str]:
+    """Returns the best tier a format qualifies for, or None if it can't be streamed as audio."""
+    acodec = f.get('acodec')
+    if not f.get('url') or f.get('protocol') not in ('https', 'http') or acodec == 'none':
+        return None
+    audio_only = f.get('vcodec') == 'none'
+    if audio_only and acodec in _AUDIO_CODEC_PREFERENCE:
+        return acodec
+    if 'bestaudio' in f.get('format_id', '').lower() or 'bestaudio' in f.get('format_note', '').lower():
+        return 'bestaudio'
+    return 'audio-only' if audio_only else 'any'
+
+def _pick_audio_format(formats: list) -> tuple[Optional[dict], Optional[str]]:
+    """Picks the best streamable audio format in one pass. Returns (format, tier it matched) or (None, None)."""
+    # Lowest rank wins; the index breaks ties in favour of the first format seen, as yt-dlp orders them
+    best = min(((_AUDIO_FORMAT_RANK[tier], i, tier) for i, f in enumerate(formats) if (tier := _audio_format_tier(f))), default=None)
+    if best is None:
+        return None, None
+    return formats[best[1]], best[2]
+
+def _persist_ttl(info: dict) -> int:
+    """Seconds a persisted copy of info stays usable: INFO_CACHE_PERSIST_TTL, cut short by any stream URL expiring sooner."""
+    ttl = INFO_CACHE_PERSIST_TTL
+    urls = [info.get('url')] + [f.get('url') for f in info.get('formats') or ()]
+    for url in urls:
+        match = _STREAM_EXPIRE_RE.search(url) if url else None
+        if match:
+            ttl = min(ttl, int(match.group(1)) - time.time() - 300) # Leave time to actually play it
+    return int(ttl)
+
+# The parts of an extraction MusicCog reads; persisted results keep only these
+_PERSIST_FIELDS = ('_type', 'id', 'title', 'url', 'webpage_url', 'original_url', 'duration', 'protocol', 'acodec', 'vcodec', 'format_id', 'format_note')
+
+def _persistable_info(info: dict) -> dict:
+    """Builds a new, JSON-ready copy of info with just what playback needs: the fields above, the audio format
+    _process_entry would pick and slimmed entries. Shares nothing mutable with info, so it can be serialized off-loop."""
+    slim = {k: info[k] for k in _PERSIST_FIELDS if k in info}
+    if 'formats' in info:
+        best_format, _ = _pick_audio_format(info['formats'] or [])
+        slim['formats'] = [_persistable_info(best_format)] if best_format else []
+    elif info.get('requested_formats'):
+        slim['requested_formats'] = [_persistable_info(info['requested_formats'][0])]
+    if info.get('entries'):
+        slim['entries'] = [_persistable_info(entry) if entry else None for entry in info['entries']]
+    return slim
+
+# --- Duration Helper ---
+def _format_duration(duration: Optional[int]) -> str:
+    """Formats a duration in seconds into HH:MM:SS or MM:SS."""
+    if duration is None:
+        return "N/A"
+    try:
+        duration_int = int(duration)
+        if duration_int < 0: return "N/A" # Handle potential negative durations
+    except (ValueError, TypeError):
+        return "N/A"
+
+    mins, secs = divmod(duration_int, 60)
+    hrs, mins = divmod(mins, 60)
+
+    if hrs > 0:
+        return f"{hrs:02d}:{mins:02d}:{secs:02d}"
+    else:
+        return f"{mins:02d}:{secs:02d}"
 
 # --- Song Class ---
 class Song:
-    """Represents a song to be played."""
-    def __init__(self, source_url: str, title: str, webpage_url: str, duration: Optional[int], requester: Optional[nextcord.Member]):
-        self.source_url: str = source_url
+    """Represents a song to be played. Playlist entries start without a source_url until MusicCog.resolve_song fills it in."""
+    __slots__ = ('source_url', 'title', 'webpage_url', 'duration', 'requester', 'duration_str')
+
+    def __init__(self, source_url: Optional[str], title: str, webpage_url: str, duration: Optional[int], requester: Optional[nextcord.Member]):
+        self.source_url: Optional[str] = source_url
         self.title: str = title
         self.webpage_url: str = webpage_url
         self.duration: Optional[int] = duration # Store as int if available
         self.requester: Optional[nextcord.Member] = requester
+        self.duration_str: str = _format_duration(duration) # Formatted once; only resolve_song may update duration
 
     def format_duration(self) -> str:
-        """Formats the duration into HH:MM:SS or MM:SS."""
-        if self.duration is None:
-            return "N/A"
-        try:
-            duration_int = int(self.duration)
-            if duration_int < 0: return "N/A" # Handle potential negative durations
-        except (ValueError, TypeError):
-            return "N/A"
-
-        mins, secs = divmod(duration_int, 60)
-        hrs, mins = divmod(mins, 60)
-
-        if hrs > 0:
-            return f"{hrs:02d}:{mins:02d}:{secs:02d}"
-        else:
-            return f"{mins:02d}:{secs:02d}"
+        """Returns the cached HH:MM:SS or MM:SS duration string."""
+        return self.duration_str
 
 # --- Music Player View ---
 class MusicPlayerView(nextcord.ui.View):
@@ -115,7 +339,7 @@ class MusicPlayerView(nextcord.ui.View):
         is_playing = is_connected and vc.is_playing()
         is_paused = is_connected and vc.is_paused()
         is_active = is_playing or is_paused
-        has_queue = bool(state and state.queue) # Check if queue is not empty
+        has_queue = bool(state and not state.queue.empty()) # Check if queue is not empty
 
         # Get button references safely
         pause_resume_btn: Optional[nextcord.ui.Button] = nextcord.utils.get(self.children, custom_id="music_pause_resume")
@@ -200,11 +424,11 @@ class MusicPlayerView(nextcord.ui.View):
                 # Ephemeral followup is good here
                 await interaction.followup.send(f"Playback {action_taken}.", ephemeral=True)
         except nextcord.NotFound:
-            logger.warning(f"Failed to edit original player message (NotFound) on pause/resume (Guild ID: {self.guild_id})")
+            logger.warning("Failed to edit original player message (NotFound) on pause/resume (Guild ID: %s)", self.guild_id)
             if action_taken:
                  await interaction.followup.send(f"Playback {action_taken}, but the controls message seems to be missing.", ephemeral=True)
         except Exception as e:
-            logger.error(f"Error editing player message on pause/resume (Guild ID: {self.guild_id}): {e}")
+            logger.error("Error editing player message on pause/resume (Guild ID: %s): %s", self.guild_id, e)
             if action_taken:
                  await interaction.followup.send(f"Playback {action_taken}, but failed to update controls.", ephemeral=True)
 
@@ -217,7 +441,7 @@ class MusicPlayerView(nextcord.ui.View):
         await interaction.response.defer(ephemeral=True)
 
         current_title = state.current_song.title if state.current_song else "the current track"
-        logger.info(f"[Guild {self.guild_id}] Song '{current_title}' skipped via button by {interaction.user}")
+        logger.info("[Guild %s] Song '%s' skipped via button by %s", self.guild_id, current_title, interaction.user)
         state.voice_client.stop()
 
         await interaction.followup.send(f"Skipped **{current_title}**.", ephemeral=True)
@@ -229,7 +453,7 @@ class MusicPlayerView(nextcord.ui.View):
             return await interaction.response.send_message("Nothing is playing to stop.", ephemeral=True)
 
         await interaction.response.defer(ephemeral=True)
-        logger.info(f"[Guild {self.guild_id}] Playback stopped via button by {interaction.user}")
+        logger.info("[Guild %s] Playback stopped via button by %s", self.guild_id, interaction.user)
 
         await state.stop_playback()
 
@@ -251,11 +475,11 @@ class MusicPlayerView(nextcord.ui.View):
             else:
                 await interaction.response.send_message("The queue is empty and nothing is playing.", ephemeral=True)
         except Exception as e:
-            logger.error(f"Error building or sending queue embed (Guild ID: {self.guild_id}): {e}", exc_info=True)
+            logger.error("Error building or sending queue embed (Guild ID: %s): %s", self.guild_id, e, exc_info=True)
             await interaction.response.send_message("Sorry, an error occurred while trying to display the queue.", ephemeral=True)
 
     async def on_timeout(self):
-        logger.debug(f"MusicPlayerView timed out or stopped (Guild ID: {self.guild_id})")
+        logger.debug("MusicPlayerView timed out or stopped (Guild ID: %s)", self.guild_id)
         state = self._get_state()
 
         for item in self.children:
@@ -269,31 +493,60 @@ class MusicPlayerView(nextcord.ui.View):
                     if channel and isinstance(channel, nextcord.TextChannel):
                         message = await channel.fetch_message(state.current_player_message_id)
                         if message and message.components:
-                            logger.debug(f"Editing message {state.current_player_message_id} on timeout to show disabled view.")
+                            logger.debug("Editing message %s on timeout to show disabled view.", state.current_player_message_id)
                             await message.edit(view=self)
                 except (nextcord.NotFound, nextcord.Forbidden, AttributeError) as e:
-                    logger.warning(f"Failed to edit message on view timeout (Guild ID: {self.guild_id}): {e}.")
+                    logger.warning("Failed to edit message on view timeout (Guild ID: %s): %s.", self.guild_id, e)
                 except Exception as e_inner:
-                     logger.error(f"Unexpected error editing message on view timeout (Guild ID: {self.guild_id}): {e_inner}", exc_info=True)
+                     logger.error("Unexpected error editing message on view timeout (Guild ID: %s): %s", self.guild_id, e_inner, exc_info=True)
             state.current_player_view = None
 # --- End of MusicPlayerView ---
 
 # --- Guild Music State ---
 class GuildMusicState:
     """Manages music playback state for a single guild."""
-    def __init__(self, bot: commands.Bot, guild_id: int):
+    __slots__ = (
+        'bot', 'cog', 'guild_id', 'queue', 'voice_client', 'current_song', 'volume', 'play_next_song',
+        '_playback_task', '_lock', 'last_command_channel_id', 'current_player_message_id', 'current_player_view',
+        '_enqueue_tasks', '_last_error_notice', '_prefetch_task', 'last_queue_reply',
+    )
+
+    def __init__(self, bot: commands.Bot, guild_id: int, cog: 'MusicCog'):
         self.bot: commands.Bot = bot
+        self.cog: 'MusicCog' = cog # Owning cog; avoids bot.get_cog("Music") lookups
         self.guild_id: int = guild_id
-        self.queue: deque[Song] = deque()
+        self.queue: asyncio.Queue[Song] = asyncio.Queue()
         self.voice_client: Optional[nextcord.VoiceClient] = None
         self.current_song: Optional[Song] = None
         self.volume: float = 0.5
         self.play_next_song: asyncio.Event = asyncio.Event()
         self._playback_task: Optional[asyncio.Task] = None
-        self._lock: asyncio.Lock = asyncio.Lock()
+        self._lock: asyncio.Lock = asyncio.Lock() # Serializes voice connect/move; the queue itself needs no lock
         self.last_command_channel_id: Optional[int] = None # Channel where last music command was used OR where player message is
         self.current_player_message_id: Optional[int] = None
         self.current_player_view: Optional[MusicPlayerView] = None
+        self._enqueue_tasks: set[asyncio.Task] = set() # Background playlist enqueues, cancelled on stop
+        self._last_error_notice: float = float('-inf') # Loop time of the last error message sent
+        self._prefetch_task: Optional[asyncio.Task] = None # Resolves the next placeholder while the current song plays
+        self.last_queue_reply: Optional[tuple[int, float, dict]] = None # (channel_id, sent at, embed dict) of the last ?queue embed
+
+    def queued_songs(self) -> List[Song]:
+        """Returns a snapshot of the songs waiting in the queue, in play order."""
+        return list(self.queue._queue)
+
+    def _requeue_front(self, song: Song):
+        """Puts a song back at the head of the queue (e.g. after an aborted play attempt)."""
+        self.queue._queue.appendleft(song)
+
+    def _clear_queue(self):
+        """Drains all pending songs from the queue."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def track_enqueue_task(self, task: asyncio.Task):
+        """Registers a background playlist enqueue so stop_playback can cancel it."""
+        self._enqueue_tasks.add(task)
+        task.add_done_callback(self._enqueue_tasks.discard)
 
     def _create_now_playing_embed(self, song: Optional[Song]) -> Optional[nextcord.Embed]:
         """Creates the 'Now Playing' embed."""
@@ -302,7 +555,7 @@ class GuildMusicState:
 
         embed = nextcord.Embed(title="Now Playing", color=nextcord.Color.green())
         embed.description = f"**[{song.title}]({song.webpage_url})**"
-        embed.add_field(name="Duration", value=song.format_duration(), inline=True)
+        embed.add_field(name="Duration", value=song.duration_str, inline=True)
 
         requester = song.requester
         if requester:
@@ -320,12 +573,12 @@ class GuildMusicState:
         channel_id = self.last_command_channel_id
 
         if not channel_id:
-            logger.warning(f"{log_prefix} Cannot update player message: No command channel ID stored.")
+            logger.warning("%s Cannot update player message: No command channel ID stored.", log_prefix)
             return
 
         channel = self.bot.get_channel(channel_id)
         if not channel or not isinstance(channel, nextcord.TextChannel):
-            logger.warning(f"{log_prefix} Cannot update player message: Channel ID {channel_id} not found or not a text channel.")
+            logger.warning("%s Cannot update player message: Channel ID %s not found or not a text channel.", log_prefix, channel_id)
             self.current_player_message_id = None
             self.current_player_view = None
             return
@@ -336,209 +589,225 @@ class GuildMusicState:
         if message_id:
             try:
                 message_to_edit = await channel.fetch_message(message_id)
-                logger.debug(f"{log_prefix} Found existing message {message_id}")
+                logger.debug("%s Found existing message %s", log_prefix, message_id)
             except nextcord.NotFound:
-                logger.warning(f"{log_prefix} Player message {message_id} not found (likely deleted).")
+                logger.warning("%s Player message %s not found (likely deleted).", log_prefix, message_id)
                 self.current_player_message_id = None
                 message_to_edit = None
             except nextcord.Forbidden:
-                logger.error(f"{log_prefix} Lacking permissions to fetch player message {message_id}.")
+                logger.error("%s Lacking permissions to fetch player message %s.", log_prefix, message_id)
                 self.current_player_message_id = None
                 return
             except Exception as e:
-                logger.error(f"{log_prefix} Error fetching player message {message_id}: {e}", exc_info=True)
+                logger.error("%s Error fetching player message %s: %s", log_prefix, message_id, e, exc_info=True)
                 message_to_edit = None
 
         try:
             if message_to_edit:
                 await message_to_edit.edit(content=content, embed=embed, view=view)
-                logger.debug(f"{log_prefix} Edited message {message_id}.")
+                logger.debug("%s Edited message %s.", log_prefix, message_id)
             elif embed or view or content:
                 new_message = await channel.send(content=content, embed=embed, view=view)
                 self.current_player_message_id = new_message.id
                 if isinstance(view, MusicPlayerView):
                     self.current_player_view = view
-                logger.info(f"{log_prefix} Sent new player message {new_message.id}.")
+                logger.info("%s Sent new player message %s.", log_prefix, new_message.id)
             else:
-                logger.debug(f"{log_prefix} No content, embed, or view provided; nothing to send/edit.")
+                logger.debug("%s No content, embed, or view provided; nothing to send/edit.", log_prefix)
 
         except nextcord.Forbidden:
-            logger.error(f"{log_prefix} Lacking permissions to send/edit player message in channel {channel_id}.")
+            logger.error("%s Lacking permissions to send/edit player message in channel %s.", log_prefix, channel_id)
             self.current_player_message_id = None
             self.current_player_view = None
         except nextcord.HTTPException as e:
-            logger.error(f"{log_prefix} HTTP error sending/editing player message: {e}", exc_info=False)
+            logger.error("%s HTTP error sending/editing player message: %s", log_prefix, e, exc_info=False)
             if e.status == 404 and message_to_edit:
-                logger.warning(f"{log_prefix} Message {message_id} was deleted before edit could complete.")
+                logger.warning("%s Message %s was deleted before edit could complete.", log_prefix, message_id)
                 self.current_player_message_id = None
                 self.current_player_view = None
         except Exception as e:
-            logger.error(f"{log_prefix} Unexpected error updating player message: {e}", exc_info=True)
+            logger.error("%s Unexpected error updating player message: %s", log_prefix, e, exc_info=True)
     # --- End _update_player_message ---
 
     async def _playback_loop(self):
         """The main loop that handles dequeuing songs and playing them."""
         await self.bot.wait_until_ready()
         log_prefix = f"[Guild {self.guild_id}] PlaybackLoop:"
-        logger.info(f"{log_prefix} Starting.")
-
-        music_cog: Optional['MusicCog'] = self.bot.get_cog("Music")
-        if not music_cog:
-            logger.critical(f"{log_prefix} MusicCog instance not found! Cannot proceed.")
-            return
+        logger.info("%s Starting.", log_prefix)
 
         while True:
             self.play_next_song.clear()
-            logger.debug(f"{log_prefix} Loop top, event cleared.")
-            song_to_play: Optional[Song] = None
-            vc_ok = False
+            logger.debug("%s Loop top, event cleared.", log_prefix)
 
             # --- Check Voice Client State ---
             if self.voice_client and self.voice_client.is_connected():
-                 vc_ok = True
                  if self.voice_client.is_playing() or self.voice_client.is_paused():
-                     logger.debug(f"{log_prefix} VC active, waiting for play_next_song event...")
+                     logger.debug("%s VC active, waiting for play_next_song event...", log_prefix)
                      await self.play_next_song.wait()
-                     logger.debug(f"{log_prefix} Resuming loop after VC became idle.")
+                     logger.debug("%s Resuming loop after VC became idle.", log_prefix)
                      continue
             else:
                 # --- Handle Unexpected VC Disconnection ---
-                logger.warning(f"{log_prefix} Voice client is not connected.")
-                async with self._lock:
-                    if self.current_song:
-                        logger.warning(f"{log_prefix} Re-queuing '{self.current_song.title}' due to disconnect.")
-                        self.queue.appendleft(self.current_song)
-                        self.current_song = None
+                logger.warning("%s Voice client is not connected.", log_prefix)
+                if self.current_song:
+                    logger.warning("%s Re-queuing '%s' due to disconnect.", log_prefix, self.current_song.title)
+                    self._requeue_front(self.current_song)
+                    self.current_song = None
 
                 if self.current_player_view:
-                    logger.debug(f"{log_prefix} Stopping player view due to disconnect.")
+                    logger.debug("%s Stopping player view due to disconnect.", log_prefix)
                     self.current_player_view.stop()
                     self.bot.loop.create_task(self._update_player_message(content="*Bot disconnected from voice.*", embed=None, view=None))
                     self.current_player_view = None
 
                 self.current_player_message_id = None
-                logger.info(f"{log_prefix} Exiting loop due to disconnect.")
+                logger.info("%s Exiting loop due to disconnect.", log_prefix)
                 return
 
             # --- Get Next Song ---
-            if vc_ok:
-                async with self._lock:
-                    if self.queue:
-                        song_to_play = self.queue.popleft()
-                        self.current_song = song_to_play
-                        logger.info(f"{log_prefix} Popped '{song_to_play.title}'. Queue length: {len(self.queue)}")
-                    else:
-                        # --- Handle Empty Queue ---
-                        if self.current_song:
-                             logger.info(f"{log_prefix} Queue empty after '{self.current_song.title}' finished.")
-                             finished_embed = self._create_now_playing_embed(self.current_song)
-                             if finished_embed: finished_embed.title = "Finished Playing"
-
-                             disabled_view = self.current_player_view
-                             if disabled_view:
-                                 disabled_view.stop()
-                                 for item in disabled_view.children:
-                                     if isinstance(item, nextcord.ui.Button): item.disabled = True
-
-                             self.bot.loop.create_task(self._update_player_message(content="*Queue finished.*", embed=finished_embed, view=disabled_view))
-                             self.current_song = None
-                             self.current_player_view = None
-                        else:
-                             logger.debug(f"{log_prefix} Queue remains empty.")
-
-            # --- Wait or Play ---
-            if not song_to_play:
-                logger.info(f"{log_prefix} Queue is empty. Waiting for play_next_song event...")
-                await self.play_next_song.wait()
-                logger.info(f"{log_prefix} Event received, restarting loop.")
-                continue
+            if not self.queue.empty():
+                song_to_play = self.queue.get_nowait() # Checked and popped in one step, no suspension
+            else:
+                # --- Handle Empty Queue ---
+                if self.current_song:
+                     logger.info("%s Queue empty after '%s' finished.", log_prefix, self.current_song.title)
+                     finished_embed = self._create_now_playing_embed(self.current_song)
+                     if finished_embed: finished_embed.title = "Finished Playing"
+
+                     disabled_view = self.current_player_view
+                     if disabled_view:
+                         disabled_view.stop()
+                         for item in disabled_view.children:
+                             if isinstance(item, nextcord.ui.Button): item.disabled = True
+
+                     self.bot.loop.create_task(self._update_player_message(content="*Queue finished.*", embed=finished_embed, view=disabled_view))
+                     self.current_song = None
+                     self.current_player_view = None
+                else:
+                     logger.debug("%s Queue remains empty.", log_prefix)
+                logger.info("%s Queue is empty. Waiting for a song to be queued...", log_prefix)
+
+                # --- Block until a song is queued ---
+                try:
+                    song_to_play = await asyncio.wait_for(self.queue.get(), timeout=IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.info("%s Inactivity timeout (%.0fs) reached. Cleaning up.", log_prefix, IDLE_TIMEOUT)
+                    self._idle_disconnect()
+                    return
+
+            self.current_song = song_to_play
+            logger.info("%s Popped '%s'. Queue length: %s", log_prefix, song_to_play.title, self.queue.qsize())
 
             # --- Play the Song ---
-            logger.info(f"{log_prefix} Attempting to play: {song_to_play.title}")
+            logger.info("%s Attempting to play: %s", log_prefix, song_to_play.title)
             audio_source = None
             play_success = False
             try:
+                if not song_to_play.source_url and not await self.cog.resolve_song(song_to_play):
+                    logger.warning("%s Could not resolve a stream for '%s'. Skipping.", log_prefix, song_to_play.title)
+                    await self._notify_channel_error(f"Couldn't load '{song_to_play.title}'. It might be unavailable or private. Skipping.")
+                    self.current_song = None
+                    continue
+
                 if not self.voice_client or not self.voice_client.is_connected():
-                    logger.warning(f"{log_prefix} VC disconnected before play could start. Re-queuing '{song_to_play.title}'.")
-                    async with self._lock: self.queue.appendleft(song_to_play); self.current_song = None
+                    logger.warning("%s VC disconnected before play could start. Re-queuing '%s'.", log_prefix, song_to_play.title)
+                    self._requeue_front(song_to_play); self.current_song = None
                     continue
 
                 if self.voice_client.is_playing() or self.voice_client.is_paused():
-                    logger.error(f"{log_prefix} Race condition? VC became active unexpectedly. Re-queuing '{song_to_play.title}'.")
-                    async with self._lock: self.queue.appendleft(song_to_play); self.current_song = None
+                    logger.error("%s Race condition? VC became active unexpectedly. Re-queuing '%s'.", log_prefix, song_to_play.title)
+                    self._requeue_front(song_to_play); self.current_song = None
                     await self.play_next_song.wait()
                     continue
 
-                original_source = nextcord.FFmpegPCMAudio(song_to_play.source_url, before_options=FFMPEG_BEFORE_OPTIONS, options=FFMPEG_OPTIONS)
-                audio_source = nextcord.PCMVolumeTransformer(original_source, volume=self.volume)
+                if abs(self.volume - 1.0) < 1e-3:
+                    # Full volume: let FFmpeg encode Opus directly and skip the per-frame PCM volume scaling.
+                    # Volume changes during this song apply from the next one (see volume_command).
+                    audio_source = nextcord.FFmpegOpusAudio(song_to_play.source_url, before_options=FFMPEG_BEFORE_OPTIONS, options=FFMPEG_OPTIONS)
+                else:
+                    original_source = nextcord.FFmpegPCMAudio(song_to_play.source_url, before_options=FFMPEG_BEFORE_OPTIONS, options=FFMPEG_OPTIONS)
+                    audio_source = nextcord.PCMVolumeTransformer(original_source, volume=self.volume)
 
                 self.voice_client.play(audio_source, after=lambda e: self._handle_after_play(e))
                 play_success = True
-                logger.info(f"{log_prefix} Called voice_client.play() for '{song_to_play.title}'.")
+                logger.info("%s Called voice_client.play() for '%s'.", log_prefix, song_to_play.title)
+                self.prefetch_next()
 
-                logger.debug(f"{log_prefix} Updating player message in channel for '{song_to_play.title}'.")
+                logger.debug("%s Updating player message in channel for '%s'.", log_prefix, song_to_play.title)
                 now_playing_embed = self._create_now_playing_embed(song_to_play)
 
                 if self.current_player_view and not self.current_player_view.is_finished():
-                    logger.debug(f"{log_prefix} Stopping previous player view.")
+                    logger.debug("%s Stopping previous player view.", log_prefix)
                     self.current_player_view.stop()
                     self.current_player_view = None
 
-                logger.debug(f"{log_prefix} Creating new MusicPlayerView.")
+                logger.debug("%s Creating new MusicPlayerView.", log_prefix)
                 try:
-                    self.current_player_view = MusicPlayerView(music_cog, self.guild_id)
-                    logger.debug(f"{log_prefix} New view created. Updating message in channel.")
+                    self.current_player_view = MusicPlayerView(self.cog, self.guild_id)
+                    logger.debug("%s New view created. Updating message in channel.", log_prefix)
                     await self._update_player_message(embed=now_playing_embed, view=self.current_player_view, content=None)
-                    logger.debug(f"{log_prefix} _update_player_message call finished. Current msg ID: {self.current_player_message_id}")
+                    logger.debug("%s _update_player_message call finished. Current msg ID: %s", log_prefix, self.current_player_message_id)
                 except Exception as e_view:
-                    logger.error(f"{log_prefix} Failed to create or update player view: {e_view}", exc_info=True)
+                    logger.error("%s Failed to create or update player view: %s", log_prefix, e_view, exc_info=True)
                     self.current_player_view = None
                     await self._update_player_message(embed=now_playing_embed, view=None, content=None)
 
             except (nextcord.errors.ClientException, ValueError, TypeError) as e:
-                logger.error(f"{log_prefix} Playback error (Client/Value/Type) for '{song_to_play.title}': {e}", exc_info=False)
+                logger.error("%s Playback error (Client/Value/Type) for '%s': %s", log_prefix, song_to_play.title, e, exc_info=False)
                 await self._notify_channel_error(f"Error playing '{song_to_play.title}'. Skipping.")
-                async with self._lock: self.current_song = None
+                self.current_song = None
             except Exception as e:
-                logger.error(f"{log_prefix} Unexpected error during playback setup for '{song_to_play.title}': {e}", exc_info=True)
+                logger.error("%s Unexpected error during playback setup for '%s': %s", log_prefix, song_to_play.title, e, exc_info=True)
                 await self._notify_channel_error(f"An unexpected error occurred while trying to play '{song_to_play.title}'. Skipping.")
-                async with self._lock: self.current_song = None
+                self.current_song = None
 
             # --- Wait for Song End ---
             if play_success:
-                logger.debug(f"{log_prefix} Waiting for play_next_song event (song '{song_to_play.title}' is playing)...")
+                logger.debug("%s Waiting for play_next_song event (song '%s' is playing)...", log_prefix, song_to_play.title)
                 await self.play_next_song.wait()
-                logger.debug(f"{log_prefix} Event received for '{song_to_play.title}'.")
+                logger.debug("%s Event received for '%s'.", log_prefix, song_to_play.title)
             else:
-                logger.debug(f"{log_prefix} Playback setup failed, continuing loop shortly.")
+                logger.debug("%s Playback setup failed, continuing loop shortly.", log_prefix)
                 await asyncio.sleep(0.1)
 
+    def prefetch_next(self):
+        """Starts resolving the next queued placeholder while the current song plays, so there's no gap between tracks."""
+        queued = self.queue._queue
+        if not queued or queued[0].source_url or not self.current_song:
+            return
+        if self._prefetch_task and not self._prefetch_task.done():
+            return # One at a time; the loop resolves anything this misses itself
+        # If the loop gets there first, its own resolve joins the in-flight extraction
+        self._prefetch_task = self.bot.loop.create_task(self.cog.resolve_song(queued[0]))
+
     def _handle_after_play(self, error: Optional[Exception]):
         """Callback executed after a song finishes playing or errors during playback."""
         log_prefix = f"[Guild {self.guild_id}] AfterPlayCallback:"
         if error:
-            logger.error(f"{log_prefix} Playback error reported: {error!r}", exc_info=error)
-            asyncio.run_coroutine_threadsafe(self._notify_channel_error(f"Playback error occurred: {error}. Skipping to next."), self.bot.loop)
+            logger.error("%s Playback error reported: %r", log_prefix, error, exc_info=error)
         else:
-            logger.debug(f"{log_prefix} Song finished successfully.")
+            logger.debug("%s Song finished successfully.", log_prefix)
+
+        logger.debug("%s Scheduling play_next_song event.", log_prefix)
+        # One plain callback hop onto the event loop covers both the wake-up and any error report
+        self.bot.loop.call_soon_threadsafe(self._after_play, error)
 
-        logger.debug(f"{log_prefix} Setting play_next_song event.")
-        self.bot.loop.call_soon_threadsafe(self.play_next_song.set)
+    def _after_play(self, error: Optional[Exception]):
+        """Runs on the event loop after a song ends: wakes the playback loop, then schedules any error report."""
+        self.play_next_song.set()
+        if error:
+            self.bot.loop.create_task(self._notify_channel_error(f"Playback error occurred: {error}. Skipping to next."))
 
     def start_playback_loop(self):
         """Starts the playback loop task if it's not already running."""
         log_prefix = f"[Guild {self.guild_id}]"
         if self._playback_task is None or self._playback_task.done():
-            logger.info(f"{log_prefix} Starting playback loop task.")
+            logger.info("%s Starting playback loop task.", log_prefix)
             self._playback_task = self.bot.loop.create_task(self._playback_loop())
             self._playback_task.add_done_callback(self._handle_loop_completion)
         else:
-            logger.debug(f"{log_prefix} Playback loop task is already running.")
+            logger.debug("%s Playback loop task is already running.", log_prefix)
 
-        if self.queue and not self.play_next_song.is_set():
-             if self.voice_client and self.voice_client.is_connected() and not self.voice_client.is_playing() and not self.voice_client.is_paused():
-                 logger.debug(f"{log_prefix} Setting play_next_song event (queue not empty, VC idle).")
-                 self.play_next_song.set()
 
     def _handle_loop_completion(self, task: asyncio.Task):
         """Callback executed when the playback loop task finishes."""
@@ -546,129 +815,144 @@ class GuildMusicState:
         log_prefix = f"[Guild {guild_id}] LoopCompletion:"
         try:
             if task.cancelled():
-                logger.info(f"{log_prefix} Playback loop task was cancelled.")
+                logger.info("%s Playback loop task was cancelled.", log_prefix)
             elif task.exception():
                 exc = task.exception()
-                logger.error(f"{log_prefix} Playback loop task failed with exception:", exc_info=exc)
+                logger.error("%s Playback loop task failed with exception:", log_prefix, exc_info=exc)
                 error_message = f"Music playback loop encountered an error: {exc}. Please try playing again."
                 asyncio.run_coroutine_threadsafe(self._notify_channel_error(error_message), self.bot.loop)
                 self.bot.loop.create_task(self.cleanup())
             else:
-                logger.info(f"{log_prefix} Playback loop task finished gracefully.")
+                logger.info("%s Playback loop task finished gracefully.", log_prefix)
         except Exception as e:
-            logger.error(f"{log_prefix} Error within _handle_loop_completion itself: {e}", exc_info=True)
+            logger.error("%s Error within _handle_loop_completion itself: %s", log_prefix, e, exc_info=True)
 
-        cog_getter = getattr(self.bot, 'get_cog', lambda n: None)
-        cog = cog_getter("Music")
-        if cog and guild_id in cog.guild_states and cog.guild_states[guild_id] is self:
+        if self.cog.guild_states.get(guild_id) is self:
              if self._playback_task is task:
                 self._playback_task = None
-                logger.debug(f"{log_prefix} Playback task reference cleared.")
+                logger.debug("%s Playback task reference cleared.", log_prefix)
         else:
-            logger.debug(f"{log_prefix} State or Cog no longer exists or task mismatch; task reference not cleared from this instance.")
+            logger.debug("%s State no longer registered with the cog; task reference not cleared from this instance.", log_prefix)
 
     async def stop_playback(self):
         """Stops the current song, clears the queue, and resets state."""
         log_prefix = f"[Guild {self.guild_id}] StopPlayback:"
-        logger.info(f"{log_prefix} Initiating stop.")
+        logger.info("%s Initiating stop.", log_prefix)
 
         view_to_stop = None
         message_id_to_clear = None
 
-        async with self._lock:
-            self.queue.clear()
-            logger.debug(f"{log_prefix} Queue cleared.")
+        for task in list(self._enqueue_tasks):
+            task.cancel() # Stop pending playlist entries from refilling the queue
+        if self._prefetch_task:
+            self._prefetch_task.cancel()
+            self._prefetch_task = None
+        self._clear_queue()
+        logger.debug("%s Queue cleared.", log_prefix)
 
-            vc = self.voice_client
-            if vc and vc.is_connected() and (vc.is_playing() or vc.is_paused()):
-                logger.info(f"{log_prefix} Stopping voice client playback.")
-                vc.stop()
+        vc = self.voice_client
+        if vc and vc.is_connected() and (vc.is_playing() or vc.is_paused()):
+            logger.info("%s Stopping voice client playback.", log_prefix)
+            vc.stop()
 
-            self.current_song = None
-            logger.debug(f"{log_prefix} Current song cleared.")
+        self.current_song = None
+        logger.debug("%s Current song cleared.", log_prefix)
 
-            view_to_stop = self.current_player_view
-            message_id_to_clear = self.current_player_message_id
+        view_to_stop = self.current_player_view
+        message_id_to_clear = self.current_player_message_id
 
-            self.current_player_view = None
-            self.current_player_message_id = None
+        self.current_player_view = None
+        self.current_player_message_id = None
 
-            if not self.play_next_song.is_set():
-                logger.debug(f"{log_prefix} Setting play_next_song event to prevent loop waiting.")
-                self.play_next_song.set()
+        if not self.play_next_song.is_set():
+            logger.debug("%s Setting play_next_song event to prevent loop waiting.", log_prefix)
+            self.play_next_song.set()
 
         if view_to_stop and not view_to_stop.is_finished():
-            logger.debug(f"{log_prefix} Stopping player view instance.")
+            logger.debug("%s Stopping player view instance.", log_prefix)
             view_to_stop.stop()
 
             for item in view_to_stop.children:
                 if isinstance(item, nextcord.ui.Button): item.disabled = True
 
             if message_id_to_clear and self.last_command_channel_id:
-                logger.debug(f"{log_prefix} Scheduling player message update to show stopped state.")
+                logger.debug("%s Scheduling player message update to show stopped state.", log_prefix)
                 self.bot.loop.create_task(self._update_player_message(content="*Playback stopped.*", embed=None, view=view_to_stop))
             else:
-                 logger.debug(f"{log_prefix} No message ID or channel to update for stopped state.")
+                 logger.debug("%s No message ID or channel to update for stopped state.", log_prefix)
 
     async def cleanup(self):
         """Comprehensive cleanup: stops playback, cancels loop, disconnects VC, resets state."""
         guild_id = self.guild_id
         log_prefix = f"[Guild {guild_id}] Cleanup:"
-        logger.info(f"{log_prefix} Starting cleanup process.")
+        logger.info("%s Starting cleanup process.", log_prefix)
 
         await self.stop_playback()
 
         task = self._playback_task
         if task and not task.done():
-            logger.info(f"{log_prefix} Cancelling playback loop task.")
+            logger.info("%s Cancelling playback loop task.", log_prefix)
             task.cancel()
             try:
                 await asyncio.wait_for(task, timeout=5.0)
-                logger.debug(f"{log_prefix} Playback loop task cancellation processed.")
+                logger.debug("%s Playback loop task cancellation processed.", log_prefix)
             except asyncio.CancelledError:
-                logger.debug(f"{log_prefix} Playback loop task successfully cancelled.")
+                logger.debug("%s Playback loop task successfully cancelled.", log_prefix)
             except asyncio.TimeoutError:
-                logger.warning(f"{log_prefix} Timeout waiting for playback loop task to cancel.")
+                logger.warning("%s Timeout waiting for playback loop task to cancel.", log_prefix)
             except Exception as e:
-                logger.error(f"{log_prefix} Error occurred while awaiting loop task cancellation: {e}", exc_info=True)
+                logger.error("%s Error occurred while awaiting loop task cancellation: %s", log_prefix, e, exc_info=True)
         self._playback_task = None
 
         vc = self.voice_client
         if vc and vc.is_connected():
-            logger.info(f"{log_prefix} Disconnecting voice client.")
+            logger.info("%s Disconnecting voice client.", log_prefix)
             try:
                 await vc.disconnect(force=True)
-                logger.info(f"{log_prefix} Voice client disconnected.")
+                logger.info("%s Voice client disconnected.", log_prefix)
             except Exception as e:
-                logger.error(f"{log_prefix} Error disconnecting voice client: {e}", exc_info=True)
+                logger.error("%s Error disconnecting voice client: %s", log_prefix, e, exc_info=True)
         self.voice_client = None
 
         self.current_song = None
         self.current_player_view = None
         self.current_player_message_id = None
 
-        logger.info(f"{log_prefix} Cleanup finished.")
+        logger.info("%s Cleanup finished.", log_prefix)
+
+    def _idle_disconnect(self):
+        """Drops this guild's state and schedules its cleanup after the playback loop went idle."""
+        # Unregistered synchronously, so a play that finishes extracting after this point gets a fresh state to queue on
+        if self.cog.guild_states.get(self.guild_id) is self:
+            self.cog.remove_guild_state(self.guild_id)
+            logger.info("[Guild %s] GuildMusicState removed after inactivity.", self.guild_id)
+        self.bot.loop.create_task(self.cleanup())
 
     async def _notify_channel_error(self, message: str):
         """Sends an error message embed to the last used command channel."""
         channel_id = self.last_command_channel_id
         guild_id = self.guild_id
         if not channel_id:
-            logger.warning(f"[Guild {guild_id}] Cannot send error notification: No command channel ID stored.")
+            logger.warning("[Guild %s] Cannot send error notification: No command channel ID stored.", guild_id)
             return
+        now = self.bot.loop.time()
+        if now - self._last_error_notice < ERROR_NOTICE_INTERVAL:
+            logger.debug("[Guild %s] Suppressing error notification (rate limited): %s", guild_id, message)
+            return
+        self._last_error_notice = now
 
         try:
             channel = self.bot.get_channel(channel_id)
             if channel and isinstance(channel, nextcord.abc.Messageable):
                 embed = nextcord.Embed(title="Music Error", description=message, color=nextcord.Color.red())
                 await channel.send(embed=embed, delete_after=30.0)
-                logger.debug(f"[Guild {guild_id}] Sent error notification to channel {channel_id}.")
+                logger.debug("[Guild %s] Sent error notification to channel %s.", guild_id, channel_id)
             else:
-                logger.warning(f"[Guild {guild_id}] Cannot find channel {channel_id} to send error notification.")
+                logger.warning("[Guild %s] Cannot find channel %s to send error notification.", guild_id, channel_id)
         except nextcord.Forbidden:
-             logger.error(f"[Guild {guild_id}] Lacking permissions to send error notification in channel {channel_id}.")
+             logger.error("[Guild %s] Lacking permissions to send error notification in channel %s.", guild_id, channel_id)
         except Exception as e:
-            logger.error(f"[Guild {guild_id}] Failed to send error notification: {e}", exc_info=True)
+            logger.error("[Guild %s] Failed to send error notification: %s", guild_id, e, exc_info=True)
 # --- End GuildMusicState ---
 
 # --- Music Cog ---
@@ -678,86 +962,95 @@ class MusicCog(commands.Cog, name="Music"):
     def __init__(self, bot: commands.Bot):
         self.bot: commands.Bot = bot
         self.guild_states: dict[int, GuildMusicState] = {}
+        self.feedback_batcher: FeedbackBatcher = FeedbackBatcher()
+        self._extract_inflight: dict[tuple, asyncio.Task] = {} # Identical in-flight yt-dlp calls share one task
+        self._extract_semaphore: asyncio.Semaphore = asyncio.Semaphore(MAX_CONCURRENT_EXTRACTIONS)
+        # yt-dlp gets its own threads so long playlist lookups can't starve the loop's default executor
+        self._ytdl_pool = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_EXTRACTIONS, thread_name_prefix='ytdl')
+        self._info_cache: OrderedDict[tuple, tuple[float, Optional[dict], Optional[str]]] = OrderedDict() # key -> (expires, info, error message)
         try:
+            os.makedirs(YTDL_CACHE_DIR, exist_ok=True)
             self.ydl = yt_dlp.YoutubeDL(YDL_OPTS)
+            self.ydl_single = yt_dlp.YoutubeDL(YDL_OPTS_SINGLE)
         except Exception as e:
-             logger.critical(f"Failed to initialize YoutubeDL: {e}", exc_info=True)
+             logger.critical("Failed to initialize YoutubeDL: %s", e, exc_info=True)
              raise RuntimeError("YoutubeDL failed to initialize, MusicCog cannot function.") from e
 
+    def cog_unload(self):
+        """Drops any feedback DMs still waiting to be sent and stops the yt-dlp threads."""
+        self.feedback_batcher.close()
+        self._ytdl_pool.shutdown(wait=False, cancel_futures=True)
+
     def get_guild_state(self, guild_id: int) -> GuildMusicState:
         """Gets or creates the GuildMusicState for a guild."""
         if guild_id not in self.guild_states:
-            logger.info(f"[Guild {guild_id}] Creating new GuildMusicState.")
-            self.guild_states[guild_id] = GuildMusicState(self.bot, guild_id)
+            logger.info("[Guild %s] Creating new GuildMusicState.", guild_id)
+            self.guild_states[guild_id] = GuildMusicState(self.bot, guild_id, self)
         return self.guild_states[guild_id]
 
+    def remove_guild_state(self, guild_id: int) -> bool:
+        """Forgets the GuildMusicState for a guild. Returns True if one was registered."""
+        return self.guild_states.pop(guild_id, None) is not None
+
     async def build_queue_embed(self, state: GuildMusicState) -> Optional[nextcord.Embed]:
          """Builds the queue information embed."""
          log_prefix = f"[Guild {state.guild_id}] QueueEmbed:"
-         logger.debug(f"{log_prefix} Building queue embed.")
+         logger.debug("%s Building queue embed.", log_prefix)
 
-         async with state._lock:
-             current_song = state.current_song
-             queue_copy = list(state.queue)
+         current_song = state.current_song
+         queue_copy = state.queued_songs()
 
          if not current_song and not queue_copy:
-             logger.debug(f"{log_prefix} Queue and current song are empty.")
+             logger.debug("%s Queue and current song are empty.", log_prefix)
              return None
 
          embed = nextcord.Embed(title="Queue", color=nextcord.Color.blurple())
          now_playing_value = "Nothing playing."
-         queue_duration_secs = 0
 
          if current_song:
              player_icon = "❓"
-             if state.voice_client and state.voice_client.is_connected():
-                 if state.voice_client.is_playing(): player_icon = "▶️ Playing"
-                 elif state.voice_client.is_paused(): player_icon = "⏸️ Paused"
+             vc = state.voice_client
+             if vc and vc.is_connected():
+                 if vc.is_playing(): player_icon = "▶️ Playing"
+                 elif vc.is_paused(): player_icon = "⏸️ Paused"
                  else: player_icon = "⏹️ Idle"
 
              requester_mention = current_song.requester.mention if current_song.requester else "Unknown"
              now_playing_value = (
                  f"{player_icon}: **[{current_song.title}]({current_song.webpage_url})** "
-                 f"`[{current_song.format_duration()}]` Req: {requester_mention}"
+                 f"`[{current_song.duration_str}]` Req: {requester_mention}"
              )
          embed.add_field(name="Now Playing", value=now_playing_value, inline=False)
 
          if queue_copy:
-             queue_lines = []
-             current_length = 0
              char_limit = 950
              max_list_display = 15
+             # Song.duration is already an int (or None) from _process_entry, so no per-song coercion
+             queue_duration_secs = sum(song.duration for song in queue_copy if song.duration)
+
+             queue_lines = [
+                 f"`{i}.` [{song.title}]({song.webpage_url}) "
+                 f"`[{song.duration_str}]` R: {song.requester.display_name if song.requester else 'Unknown'}"
+                 for i, song in enumerate(queue_copy[:max_list_display], start=1)
+             ]
+             # Keep only as many lines as fit in the embed field
              songs_shown = 0
-
-             for i, song in enumerate(queue_copy):
-                 if song.duration:
-                     try: queue_duration_secs += int(song.duration)
-                     except (ValueError, TypeError): pass
-
-                 if songs_shown < max_list_display:
-                     requester_name = song.requester.display_name if song.requester else "Unknown"
-                     line = (
-                         f"`{i + 1}.` [{song.title}]({song.webpage_url}) "
-                         f"`[{song.format_duration()}]` R: {requester_name}\n"
-                     )
-                     if current_length + len(line) <= char_limit:
-                         queue_lines.append(line)
-                         current_length += len(line)
-                         songs_shown += 1
-                     else:
-                         remaining_count = len(queue_copy) - i
-                         if remaining_count > 0:
-                              queue_lines.append(f"\n*...and {remaining_count} more.*")
-                         break
-
-             if songs_shown == max_list_display and len(queue_copy) > max_list_display:
-                 remaining_count = len(queue_copy) - max_list_display
-                 queue_lines.append(f"\n*...and {remaining_count} more.*")
-
-             total_duration_str = Song(None, None, None, queue_duration_secs, None).format_duration() if queue_duration_secs > 0 else "N/A"
+             current_length = 0
+             for line in queue_lines:
+                 line_length = len(line) + 1 # Including the joining newline
+                 if current_length + line_length > char_limit: break
+                 current_length += line_length
+                 songs_shown += 1
+             del queue_lines[songs_shown:]
+
+             remaining_count = len(queue_copy) - songs_shown
+             if remaining_count > 0:
+                 queue_lines.append(f"*...and {remaining_count} more.*")
+
+             total_duration_str = _format_duration(queue_duration_secs) if queue_duration_secs > 0 else "N/A"
              queue_header = f"Up Next ({len(queue_copy)} song{'s' if len(queue_copy) != 1 else ''}, Total: {total_duration_str})"
 
-             queue_value = "".join(queue_lines).strip()
+             queue_value = "\n".join(queue_lines)
              if not queue_value and len(queue_copy) > 0:
                  queue_value = f"{len(queue_copy)} songs in queue..."
 
@@ -772,168 +1065,248 @@ class MusicCog(commands.Cog, name="Music"):
          volume_percent = int(state.volume * 100)
          embed.set_footer(text=f"Total Songs: {total_songs} | Volume: {volume_percent}%")
 
-         logger.debug(f"{log_prefix} Embed built successfully.")
+         logger.debug("%s Embed built successfully.", log_prefix)
          return embed
 
     # --- Extraction Methods ---
-    async def _process_entry(self, entry_data: dict, requester: nextcord.Member) -> Optional[Song]:
-        """Processes a single entry from yt-dlp result, potentially re-extracting and processing if needed."""
+    async def _run_extract(self, ydl: yt_dlp.YoutubeDL, url: str, **kwargs) -> Optional[dict]:
+        """Runs ydl.extract_info in the executor, reusing recent results and sharing one call between identical in-flight requests."""
+        # Keyed on the options that shape the result, so equivalent YoutubeDL instances share entries
+        key = (ydl.params.get('extract_flat'), ydl.params.get('noplaylist'), url, tuple(sorted(kwargs.items())))
+        cached = self._info_cache.get(key)
+        if cached:
+            expires, info, error = cached
+            if expires > self.bot.loop.time():
+                self._info_cache.move_to_end(key)
+                logger.debug("Using cached extraction for '%s'.", url)
+                if error: raise yt_dlp.utils.DownloadError(error) # Fresh per caller; a shared instance's traceback would be clobbered
+                return copy.deepcopy(info)
+            del self._info_cache[key]
+        task = self._extract_inflight.get(key)
+        if task is None:
+            task = self.bot.loop.create_task(self._run_extract_bounded(key, ydl, url, kwargs))
+            self._extract_inflight[key] = task
+            task.add_done_callback(lambda _: self._extract_inflight.pop(key, None))
+        else:
+            logger.debug("Joining in-flight extraction for '%s'.", url)
+        try:
+            info = await asyncio.shield(task)
+        except yt_dlp.utils.DownloadError as e: # Likewise a fresh error per caller rather than the task's shared one
+            raise yt_dlp.utils.DownloadError(str(e)) from None
+        # The task hands back the pristine dict held in the cache; yt-dlp processing mutates info dicts, so every caller gets its own copy
+        return copy.deepcopy(info)
+
+    async def _run_extract_bounded(self, key: tuple, ydl: yt_dlp.YoutubeDL, url: str, kwargs: dict) -> Optional[dict]:
+        """Extracts (or loads from Redis) and caches the result; returns the cached dict itself, which must not be mutated."""
+        persist_key = hashlib.sha1(repr(key).encode()).hexdigest()
+        info = await self._load_persisted_info(persist_key)
+        if info:
+            logger.debug("Using persisted extraction for '%s'.", url)
+            self._cache_info(key, info, None)
+            return info
+        try:
+            async with self._extract_semaphore:
+                info = await self.bot.loop.run_in_executor(self._ytdl_pool, lambda: ydl.extract_info(url, **kwargs))
+        except yt_dlp.utils.DownloadError as e:
+            self._cache_info(key, None, str(e))
+            raise
+        self._cache_info(key, info, None)
+        if info:
+            self.bot.loop.create_task(self._persist_info(persist_key, _persistable_info(info)))
+        return info
+
+    async def _load_persisted_info(self, persist_key: str) -> Optional[dict]:
+        try:
+            payload = await asyncio.wait_for(redis_utils.get_ytdl_info(persist_key), timeout=INFO_CACHE_PERSIST_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out reading persisted extraction from Redis.")
+            return None
+        if not payload: return None
+        return await self.bot.loop.run_in_executor(None, json.loads, payload)
+
+    async def _persist_info(self, persist_key: str, info: dict):
+        ttl = _persist_ttl(info)
+        if ttl <= 0: return
+        payload = await self.bot.loop.run_in_executor(None, json.dumps, info)
+        try:
+            await asyncio.wait_for(redis_utils.set_ytdl_info(persist_key, payload, ttl), timeout=INFO_CACHE_PERSIST_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out persisting extraction to Redis.")
+
+    def _cache_info(self, key: tuple, info: Optional[dict], error: Optional[str]):
+        ttl = INFO_CACHE_TTL if info else INFO_CACHE_ERROR_TTL
+        self._info_cache[key] = (self.bot.loop.time() + ttl, info, error)
+        self._info_cache.move_to_end(key)
+        if len(self._info_cache) > INFO_CACHE_SIZE:
+            self._info_cache.popitem(last=False)
+
+    async def _process_entry(self, entry_data: dict, requester: nextcord.Member, processed: bool = False) -> Optional[Song]:
+        """Processes a single entry from yt-dlp result, potentially re-extracting and processing if needed.
+
+        Pass processed=True when entry_data already comes from a full (process=True) extraction."""
         bot_id = self.bot.user.id if self.bot.user else 'Bot'
         log_prefix = f"[{bot_id}] EntryProcessing:"
 
         if not entry_data:
-            logger.warning(f"{log_prefix} Received empty entry data.")
+            logger.warning("%s Received empty entry data.", log_prefix)
             return None
         title = entry_data.get('title', entry_data.get('id', 'N/A'))
 
-        if entry_data.get('_type') == 'url' and 'url' in entry_data and 'formats' not in entry_data and 'entries' not in entry_data:
-            logger.debug(f"{log_prefix} Flat entry detected for '{title}'. Re-extracting with processing.")
+        if not processed and _is_flat_entry(entry_data):
+            logger.debug("%s Flat entry detected for '%s'. Re-extracting with processing.", log_prefix, title)
             try:
-                loop = asyncio.get_event_loop()
-                ydl_opts_single = YDL_OPTS.copy()
-                ydl_opts_single['noplaylist'] = True
-                ydl_opts_single['extract_flat'] = False
-                ydl_single = yt_dlp.YoutubeDL(ydl_opts_single)
-                partial_extract = functools.partial(ydl_single.extract_info, entry_data['url'], download=False)
-                full_entry_data = await loop.run_in_executor(None, partial_extract)
+                full_entry_data = await self._run_extract(self.ydl_single, entry_data['url'], download=False)
                 if not full_entry_data:
-                    logger.warning(f"{log_prefix} Re-extraction failed for URL: {entry_data['url']}")
+                    logger.warning("%s Re-extraction failed for URL: %s", log_prefix, entry_data['url'])
                     return None
                 entry_data = full_entry_data
+                processed = True # extract_info already ran process_ie_result
                 title = entry_data.get('title', entry_data.get('id', 'N/A'))
-                logger.debug(f"{log_prefix} Re-extraction successful for '{title}'.")
+                logger.debug("%s Re-extraction successful for '%s'.", log_prefix, title)
             except Exception as e:
-                logger.error(f"{log_prefix} Error during re-extraction for '{title}': {e}", exc_info=True)
+                logger.error("%s Error during re-extraction for '%s': %s", log_prefix, title, e, exc_info=True)
                 return None # Failed to process this entry
 
-        # Process the entry data
-        processed_data = None
-        try:
-             logger.debug(f"{log_prefix} Running process_ie_result for '{title}'...")
-             processed_data = self.ydl.process_ie_result(entry_data, download=False)
-             if not processed_data:
-                  logger.warning(f"{log_prefix} process_ie_result returned None for '{title}'.")
-                  return None
-             logger.debug(f"{log_prefix} process_ie_result completed.")
-        except Exception as process_err:
-             logger.error(f"{log_prefix} Error during process_ie_result for '{title}': {process_err}", exc_info=True)
-             return None
+        # Process the entry data (skipped when the extraction already did it)
+        processed_data = entry_data if processed else None
+        if not processed:
+            try:
+                 logger.debug("%s Running process_ie_result for '%s'...", log_prefix, title)
+                 processed_data = await self.bot.loop.run_in_executor(self._ytdl_pool, lambda: self.ydl.process_ie_result(entry_data, download=False))
+                 if not processed_data:
+                      logger.warning("%s process_ie_result returned None for '%s'.", log_prefix, title)
+                      return None
+                 logger.debug("%s process_ie_result completed.", log_prefix)
+            except Exception as process_err:
+                 logger.error("%s Error during process_ie_result for '%s': %s", log_prefix, title, process_err, exc_info=True)
+                 return None
 
         # Find Best Audio Stream URL (Now using processed_data)
-        logger.debug(f"{log_prefix} Searching for stream URL in processed data for: '{title}'")
+        logger.debug("%s Searching for stream URL in processed data for: '%s'", log_prefix, title)
         stream_url = None
         entry_to_search = processed_data
 
         if 'url' in entry_to_search and entry_to_search.get('protocol') in ('http', 'https') and entry_to_search.get('acodec') != 'none':
             stream_url = entry_to_search['url']
-            logger.debug(f"{log_prefix} Using pre-selected stream URL from processed data.")
+            logger.debug("%s Using pre-selected stream URL from processed data.", log_prefix)
         elif 'formats' in entry_to_search:
-            formats = entry_to_search.get('formats', [])
-            best_format = None
-            audio_preference = ['opus', 'aac', 'vorbis', 'mp4a', 'mp3']
-            for codec in audio_preference:
-                for f in formats:
-                    if (f.get('url') and f.get('protocol') in ('https', 'http') and f.get('acodec') == codec and f.get('vcodec') == 'none'):
-                        best_format = f; logger.debug(f"{log_prefix} Found preferred audio-only format: {codec} (ID: {f.get('format_id', 'N/A')})"); break
-                if best_format: break
-            if not best_format:
-                for f in formats:
-                    format_id = f.get('format_id', '').lower(); format_note = f.get('format_note', '').lower()
-                    if (('bestaudio' in format_id or 'bestaudio' in format_note) and f.get('url') and f.get('protocol') in ('https', 'http') and f.get('acodec') != 'none'):
-                         best_format = f; logger.debug(f"{log_prefix} Found format marked 'bestaudio' (ID: {f.get('format_id', 'N/A')})."); break
-            if not best_format:
-                for f in formats:
-                    if (f.get('url') and f.get('protocol') in ('https', 'http') and f.get('acodec') != 'none' and f.get('vcodec') == 'none'):
-                        best_format = f; logger.debug(f"{log_prefix} Using fallback audio-only format (ID: {f.get('format_id', 'N/A')})."); break
-            if not best_format:
-                for f in formats:
-                     if (f.get('url') and f.get('protocol') in ('https', 'http') and f.get('acodec') != 'none'):
-                         best_format = f; logger.warning(f"{log_prefix} Using last resort format (might include video) (ID: {f.get('format_id', 'N/A')})."); break
+            best_format, tier = _pick_audio_format(entry_to_search.get('formats', []))
+            if tier == 'any':
+                logger.warning("%s Using last resort format (might include video) (ID: %s).", log_prefix, best_format.get('format_id', 'N/A'))
+            elif best_format:
+                logger.debug("%s Picked %s format (ID: %s).", log_prefix, tier, best_format.get('format_id', 'N/A'))
             if best_format:
                 stream_url = best_format.get('url')
-                logger.debug(f"{log_prefix} Selected stream URL from format ID {best_format.get('format_id', 'N/A')}.")
-            else: logger.warning(f"{log_prefix} No suitable HTTP/S audio stream format found for '{title}'.")
+                logger.debug("%s Selected stream URL from format ID %s.", log_prefix, best_format.get('format_id', 'N/A'))
+            else: logger.warning("%s No suitable HTTP/S audio stream format found for '%s'.", log_prefix, title)
         elif 'requested_formats' in entry_to_search and not stream_url:
              req_formats = entry_to_search.get('requested_formats')
              if req_formats:
                  fmt = req_formats[0]
                  if fmt.get('url') and fmt.get('protocol') in ('https', 'http'):
-                     stream_url = fmt.get('url'); logger.debug(f"{log_prefix} Using stream URL from 'requested_formats'.")
+                     stream_url = fmt.get('url'); logger.debug("%s Using stream URL from 'requested_formats'.", log_prefix)
 
-        logger.debug(f"{log_prefix} Final stream URL found: {'Yes' if stream_url else 'No'}")
+        logger.debug("%s Final stream URL found: %s", log_prefix, 'Yes' if stream_url else 'No')
         if not stream_url:
-            logger.warning(f"{log_prefix} Could not determine a stream URL for '{title}'. Skipping entry.")
+            logger.warning("%s Could not determine a stream URL for '%s'. Skipping entry.", log_prefix, title)
             return None
-        try:
-            webpage_url = processed_data.get('webpage_url') or processed_data.get('original_url', 'N/A')
-            duration_sec = processed_data.get('duration')
-            duration_int: Optional[int] = None
-            if duration_sec is not None:
-                try: duration_int = int(duration_sec)
-                except (ValueError, TypeError): duration_int = None
-            song = Song(source_url=stream_url, title=processed_data.get('title', 'Unknown Title'), webpage_url=webpage_url, duration=duration_int, requester=requester)
-            logger.debug(f"{log_prefix} Successfully created Song object for: {song.title}")
-            return song
-        except Exception as e:
-            logger.error(f"{log_prefix} Error creating Song object for '{title}': {e}", exc_info=True)
-            return None
-
-    async def _extract_info(self, query: str, requester: nextcord.Member) -> tuple[Optional[str], List[Song]]:
-        """Extracts info using yt-dlp, handling playlists and single videos."""
+        webpage_url = processed_data.get('webpage_url') or processed_data.get('original_url', 'N/A')
+        song = Song(source_url=stream_url, title=processed_data.get('title', 'Unknown Title'), webpage_url=webpage_url,
+                    duration=_to_int_duration(processed_data.get('duration')), requester=requester)
+        logger.debug("%s Successfully created Song object for: %s", log_prefix, song.title)
+        return song
+
+    async def _iter_playlist_songs(self, entries: list, requester: nextcord.Member, log_prefix: str) -> AsyncIterator[Song]:
+        """Yields Songs for playlist entries. Flat entries become placeholders that resolve_song completes right before playback."""
+        processed_count = 0
+        original_count = 0
+        for entry in entries:
+            if not entry: continue
+            original_count += 1
+            if _is_flat_entry(entry):
+                song = Song(source_url=None, title=entry.get('title') or entry['url'], webpage_url=entry['url'],
+                            duration=_to_int_duration(entry.get('duration')), requester=requester)
+            else:
+                song = await self._process_entry(entry, requester)
+            if song:
+                processed_count += 1
+                yield song
+            else: logger.warning("%s Failed to process playlist entry: %s", log_prefix, entry.get('title', entry.get('id', 'Unknown ID')))
+        logger.info("%s Playlist processing finished. Queued %s/%s valid songs.", log_prefix, processed_count, original_count)
+
+    async def resolve_song(self, song: Song) -> bool:
+        """Fills in the stream URL of a placeholder Song. Returns False if it can't be played."""
+        if song.source_url: return True
+        resolved = await self._process_entry({'_type': 'url', 'url': song.webpage_url, 'title': song.title}, song.requester)
+        if not resolved: return False
+        song.source_url = resolved.source_url
+        song.title = resolved.title
+        song.webpage_url = resolved.webpage_url
+        if resolved.duration is not None:
+            song.duration = resolved.duration
+            song.duration_str = resolved.duration_str
+        return True
+
+    async def _extract_info(self, query: str, requester: nextcord.Member) -> tuple[Union[ExtractionError, str, None], List[Song], bool, Optional[AsyncIterator[Song]]]:
+        """Extracts info using yt-dlp, handling playlists and single videos.
+
+        Returns (playlist title or ExtractionError, songs, is_playlist, pending songs). For playlists the first
+        entry is returned up front and the rest are yielded by the pending iterator; flat entries come back as
+        placeholders whose stream URL is only fetched when they are about to play."""
         bot_id = self.bot.user.id if self.bot.user else 'Bot'
         log_prefix = f"[{bot_id}] YTDLExtraction:"
-        logger.info(f"{log_prefix} Starting extraction for query: '{query}' (Requester: {requester.name})")
+        logger.info("%s Starting extraction for query: '%s' (Requester: %s)", log_prefix, query, requester.name)
         songs_found: List[Song] = []
         playlist_title: Optional[str] = None
-        error_code: Optional[str] = None
+        error_code: Optional[ExtractionError] = None
         try:
-            loop = asyncio.get_event_loop()
-            partial_extract_initial = functools.partial(self.ydl.extract_info, query, download=False, process=False)
-            initial_data = await loop.run_in_executor(None, partial_extract_initial)
+            if _YT_VIDEO_RE.match(query.strip()):
+                # Direct video link: one processed extraction instead of a flat probe plus re-extraction
+                logger.info("%s Direct video URL detected. Extracting with processing in one pass...", log_prefix)
+                video_data = await self._run_extract(self.ydl_single, query.strip(), download=False)
+                if not video_data:
+                    logger.warning("%s Direct extraction returned no data for query: %s", log_prefix, query)
+                    return ExtractionError.NODATA, [], False, None
+                song = await self._process_entry(video_data, requester, processed=True)
+                if not song:
+                    logger.warning("%s Failed to process direct video entry.", log_prefix)
+                    return ExtractionError.PROCESS_SINGLE_FAILED, [], False, None
+                logger.info("%s Successfully processed direct video entry: %s", log_prefix, song.title)
+                return None, [song], False, None
+            initial_data = await self._run_extract(self.ydl, query, download=False, process=False)
             if not initial_data:
-                logger.warning(f"{log_prefix} Initial extraction returned no data for query: {query}")
-                return "err_nodata", []
+                logger.warning("%s Initial extraction returned no data for query: %s", log_prefix, query)
+                return ExtractionError.NODATA, [], False, None
             if 'entries' in initial_data and initial_data.get('entries'):
                 playlist_title = initial_data.get('title', 'Unknown Playlist')
                 entries = initial_data['entries']
-                logger.info(f"{log_prefix} Detected playlist: '{playlist_title}' with {len(entries)} potential entries. Processing...")
-                processed_count = 0
-                original_count = len(entries)
-                for entry in entries:
-                    if entry:
-                        song = await self._process_entry(entry, requester)
-                        if song:
-                            songs_found.append(song)
-                            processed_count += 1
-                        else: logger.warning(f"{log_prefix} Failed to process playlist entry: {entry.get('title', entry.get('id', 'Unknown ID'))}")
-                    else: original_count -= 1
-                logger.info(f"{log_prefix} Playlist processing finished. Added {processed_count}/{original_count} valid songs.")
-                if not songs_found: error_code = "err_playlist_empty_or_fail"
+                logger.info("%s Detected playlist: '%s' with %s potential entries.", log_prefix, playlist_title, len(entries))
+                pending_songs = self._iter_playlist_songs(entries, requester, log_prefix)
+                try:
+                    songs_found.append(await pending_songs.__anext__())
+                except StopAsyncIteration:
+                    return ExtractionError.PLAYLIST_EMPTY_OR_FAIL, [], True, None
+                logger.info("%s First playlist entry ready: %s. Remaining entries are queued in the background.", log_prefix, songs_found[0].title)
+                return playlist_title, songs_found, True, pending_songs
             else:
-                logger.info(f"{log_prefix} Detected single entry. Processing directly...")
+                logger.info("%s Detected single entry. Processing directly...", log_prefix)
                 song = await self._process_entry(initial_data, requester)
                 if song:
                     songs_found.append(song)
-                    logger.info(f"{log_prefix} Successfully processed single entry: {song.title}")
+                    logger.info("%s Successfully processed single entry: %s", log_prefix, song.title)
                 else:
-                    logger.warning(f"{log_prefix} Failed to process single entry.")
-                    error_code = "err_process_single_failed"
+                    logger.warning("%s Failed to process single entry.", log_prefix)
+                    error_code = ExtractionError.PROCESS_SINGLE_FAILED
 
-            if error_code: return error_code, []
-            else: return playlist_title, songs_found
+            if error_code: return error_code, [], False, None
+            else: return None, songs_found, False, None
         except yt_dlp.utils.DownloadError as e:
-            error_message = str(e).lower(); logger.error(f"{log_prefix} DownloadError during extraction: {e}")
-            err_type = 'download_generic'
-            if "unsupported url" in error_message: err_type = 'unsupported'
-            elif "video unavailable" in error_message: err_type = 'unavailable'
-            elif "private video" in error_message: err_type = 'private'
-            elif "age restricted" in error_message: err_type = 'age_restricted'
-            elif "could not extract" in error_message: err_type = 'extract_failed'
-            elif "network error" in error_message or "webpage" in error_message: err_type = 'network'
-            return f"err_{err_type}", []
+            logger.error("%s DownloadError during extraction: %s", log_prefix, e)
+            error_text = str(e).lower()
+            return next((code for marker, code in _YTDL_ERROR_MARKERS if marker in error_text), ExtractionError.DOWNLOAD_GENERIC), [], False, None
         except Exception as e:
-            logger.error(f"{log_prefix} Unexpected error during extraction: {e}", exc_info=True)
-            return "err_extraction_unexpected", []
+            logger.error("%s Unexpected error during extraction: %s", log_prefix, e, exc_info=True)
+            return ExtractionError.EXTRACTION_UNEXPECTED, [], False, None
     # --- End Extraction Methods ---
 
     # --- Listener ---
@@ -943,44 +1316,100 @@ class MusicCog(commands.Cog, name="Music"):
         if not member.guild: return
         guild_id = member.guild.id
         state = self.guild_states.get(guild_id)
-        if not state or not state.voice_client: return
+        vc = state.voice_client if state else None
+        if not vc: return
 
-        bot_voice_channel = state.voice_client.channel if state.voice_client.is_connected() else None
-        log_prefix = f"[Guild {guild_id}] VoiceStateUpdate:"
+        bot_voice_channel = vc.channel if vc.is_connected() else None
 
         if member.id == self.bot.user.id:
             if before.channel and not after.channel:
-                logger.warning(f"{log_prefix} Bot was disconnected from voice channel {before.channel.name}.")
+                logger.warning("[Guild %s] VoiceStateUpdate: Bot was disconnected from voice channel %s.", guild_id, before.channel.name)
+                # Unregistered before the (slow) cleanup, so a play finishing meanwhile gets a fresh state
+                if self.remove_guild_state(guild_id):
+                    logger.info("[Guild %s] VoiceStateUpdate: GuildMusicState removed.", guild_id)
                 await state.cleanup()
-                if guild_id in self.guild_states:
-                    del self.guild_states[guild_id]; logger.info(f"{log_prefix} GuildMusicState removed.")
             elif before.channel and after.channel and before.channel != after.channel:
-                logger.info(f"{log_prefix} Bot moved from {before.channel.name} to {after.channel.name}.")
-                if state.voice_client: state.voice_client.channel = after.channel
+                logger.info("[Guild %s] VoiceStateUpdate: Bot moved from %s to %s.", guild_id, before.channel.name, after.channel.name)
+                vc.channel = after.channel
             elif not before.channel and after.channel:
-                 logger.info(f"{log_prefix} Bot joined voice channel {after.channel.name}.")
+                 logger.info("[Guild %s] VoiceStateUpdate: Bot joined voice channel %s.", guild_id, after.channel.name)
         elif bot_voice_channel:
             user_left_bot_channel = before.channel == bot_voice_channel and after.channel != bot_voice_channel
             user_joined_bot_channel = before.channel != bot_voice_channel and after.channel == bot_voice_channel
-            current_human_members = [m for m in bot_voice_channel.members if not m.bot]
-            is_bot_alone = len(current_human_members) == 0
-
-            if user_left_bot_channel and is_bot_alone:
-                logger.info(f"{log_prefix} Last user left ({member.name}). Bot is alone in {bot_voice_channel.name}. Pausing.")
-                if state.voice_client.is_playing():
-                    state.voice_client.pause()
+            if not user_left_bot_channel and not user_joined_bot_channel: return
+
+            members = bot_voice_channel.members # Built fresh on each access, so take one snapshot
+            has_human_members = any(not m.bot for m in members)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[Guild %s] VoiceStateUpdate: User %s %s %s (%d human member(s) remaining).", guild_id, member.name,
+                             "left" if user_left_bot_channel else "joined", bot_voice_channel.name, sum(not m.bot for m in members))
+
+            if user_left_bot_channel and not has_human_members:
+                logger.info("[Guild %s] VoiceStateUpdate: Last user left (%s). Bot is alone in %s. Pausing.", guild_id, member.name, bot_voice_channel.name)
+                if vc.is_playing():
+                    vc.pause()
                     if state.current_player_view:
                         state.current_player_view._update_buttons()
                         self.bot.loop.create_task(state._update_player_message(view=state.current_player_view))
-            elif user_joined_bot_channel and state.voice_client.is_paused() and len(current_human_members) > 0:
-                 logger.info(f"{log_prefix} User {member.name} joined. Resuming playback.")
-                 state.voice_client.resume()
+            elif user_joined_bot_channel and vc.is_paused() and has_human_members:
+                 logger.info("[Guild %s] VoiceStateUpdate: User %s joined. Resuming playback.", guild_id, member.name)
+                 vc.resume()
                  if state.current_player_view:
                      state.current_player_view._update_buttons()
                      self.bot.loop.create_task(state._update_player_message(view=state.current_player_view))
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: nextcord.Guild):
+        """Cleans up and drops the music state of a guild the bot was removed from."""
+        state = self.guild_states.pop(guild.id, None)
+        if state:
+            logger.info("[Guild %s] GuildRemove: Bot removed from guild. Cleaning up music state.", guild.id)
+            await state.cleanup()
     # --- End Listener ---
 
     # --- Commands ---
+    async def _require_connected(self, ctx: commands.Context, not_connected_msg: str = "I'm not connected or playing anything.") -> Optional[GuildMusicState]:
+        """Returns the guild's state if the bot is connected to voice, otherwise DMs the author and returns None."""
+        state = self.guild_states.get(ctx.guild.id)
+        if not state or not state.voice_client or not state.voice_client.is_connected():
+            self.feedback_batcher.add(ctx.author, message=not_connected_msg) # Spammed guard errors collapse into one DM
+            return None
+        state.last_command_channel_id = ctx.channel.id
+        return state
+
+    async def _ensure_voice(self, ctx: commands.Context, state: GuildMusicState, log_prefix: str) -> bool:
+        """Joins the author's channel if needed and checks they share it with the bot. DMs the author and returns False otherwise."""
+        vc = state.voice_client
+        if not vc or not vc.is_connected():
+            if ctx.author.voice and ctx.author.voice.channel:
+                logger.info("%s Bot not connected. Attempting to join %s.", log_prefix, ctx.author.voice.channel.name)
+                try:
+                    await self.join_command(ctx) # Uses DMs for feedback; connects the same state object
+                    if not state.voice_client or not state.voice_client.is_connected():
+                        logger.warning("%s Failed to join voice channel after automatic attempt.", log_prefix)
+                        return False
+                    logger.info("%s Successfully joined voice channel.", log_prefix)
+                except Exception as e:
+                     logger.error("%s Error occurred invoking join command: %s", log_prefix, e, exc_info=True)
+                     await _send_dm_or_log(ctx.author, "An error occurred while trying to join the voice channel.")
+                     return False
+            else:
+                await _send_dm_or_log(ctx.author, "You need to be in a voice channel for me to join.")
+                return False
+        # --- Ensure User is in the Same VC ---
+        elif not ctx.author.voice or ctx.author.voice.channel != vc.channel:
+             await _send_dm_or_log(ctx.author, f"You need to be in the same voice channel as me ({vc.channel.mention}).")
+             return False
+        return True
+
+    async def _ack_and_refresh_player(self, ctx: commands.Context, state: GuildMusicState, emoji: str):
+        """Reacts to the command and refreshes the player's buttons, with both REST calls in flight at once."""
+        if not state.current_player_view:
+            await ctx.message.add_reaction(emoji)
+            return
+        state.current_player_view._update_buttons()
+        await asyncio.gather(ctx.message.add_reaction(emoji), state._update_player_message(view=state.current_player_view))
+
     @commands.command(name='play', aliases=['p'], help="Plays a song or adds it/playlist to the queue.")
     @commands.guild_only()
     async def play_command(self, ctx: commands.Context, *, query: str):
@@ -989,113 +1418,115 @@ class MusicCog(commands.Cog, name="Music"):
         state = self.get_guild_state(ctx.guild.id)
         state.last_command_channel_id = ctx.channel.id
         log_prefix = f"[Guild {ctx.guild.id}] PlayCmd:"
-        logger.info(f"{log_prefix} Received play command for '{query}' from {ctx.author.name}")
+        logger.info("%s Received play command for '%s' from %s", log_prefix, query, ctx.author.name)
 
         # --- Ensure Bot is Connected ---
-        if not state.voice_client or not state.voice_client.is_connected():
-            if ctx.author.voice and ctx.author.voice.channel:
-                logger.info(f"{log_prefix} Bot not connected. Attempting to join {ctx.author.voice.channel.name}.")
-                try:
-                    await self.join_command(ctx) # Uses DMs for feedback
-                    state = self.guild_states.get(ctx.guild.id)
-                    if not state or not state.voice_client or not state.voice_client.is_connected():
-                        logger.warning(f"{log_prefix} Failed to join voice channel after automatic attempt.")
-                        return
-                    else:
-                         logger.info(f"{log_prefix} Successfully joined voice channel.")
-                         state.last_command_channel_id = ctx.channel.id
-                except Exception as e:
-                     logger.error(f"{log_prefix} Error occurred invoking join command: {e}", exc_info=True)
-                     await _send_dm_or_log(ctx.author, "An error occurred while trying to join the voice channel.")
-                     return
-            else:
-                await _send_dm_or_log(ctx.author, "You need to be in a voice channel for me to join.")
-                return
-        # --- Ensure User is in the Same VC ---
-        elif not ctx.author.voice or ctx.author.voice.channel != state.voice_client.channel:
-             await _send_dm_or_log(ctx.author, f"You need to be in the same voice channel as me ({state.voice_client.channel.mention}).")
-             return
+        if not await self._ensure_voice(ctx, state, log_prefix): return
 
         # --- Extract Info ---
-        await ctx.trigger_typing()
         playlist_title: Optional[str] = None
         songs_to_add: List[Song] = []
-        error_code: Optional[str] = None
+        is_playlist = False
+        pending_songs: Optional[AsyncIterator[Song]] = None
+        error_code: Optional[ExtractionError] = None
         try:
-            result_tuple = await self._extract_info(query, ctx.author)
-            error_code, songs_found_or_title = result_tuple[0], result_tuple[1]
-            if isinstance(error_code, str) and error_code.startswith("err_"): songs_to_add = []
+            async with ctx.typing(): # Keeps the indicator alive for long playlist lookups
+                result_tuple = await self._extract_info(query, ctx.author)
+            error_code, songs_found_or_title, is_playlist, pending_songs = result_tuple
+            if isinstance(error_code, ExtractionError): songs_to_add = []
             else: playlist_title = error_code; songs_to_add = songs_found_or_title; error_code = None
         except Exception as e:
-            logger.error(f"{log_prefix} Unexpected exception during _extract_info call: {e}", exc_info=True)
-            error_code = "err_internal_extract"
+            logger.error("%s Unexpected exception during _extract_info call: %s", log_prefix, e, exc_info=True)
+            error_code = ExtractionError.INTERNAL_EXTRACT
 
         # --- Handle Extraction Errors ---
         if error_code:
-            error_map = {
-                'nodata': "Could not find any data for your query.",
-                'playlist_empty_or_fail': f"Could not add any songs from the playlist '{playlist_title}'. They might be unavailable or private.",
-                'process_single_failed': "Failed to process the requested track. It might be unsupported or unavailable.",
-                'unsupported': "This URL or video format is not supported.",
-                'unavailable': "This video is unavailable.", 'private': "This video is private.",
-                'age_restricted': "This video is age-restricted.", 'extract_failed': "Failed to extract information for this item.",
-                'network': "A network error occurred while fetching information.", 'download_generic': "An error occurred while trying to access the media.",
-                'extraction_unexpected': "An unexpected error occurred during information extraction.",
-                'internal_extract': "An internal error occurred while processing your request."
-            }
-            error_message = error_map.get(error_code.replace("err_", ""), "An unknown error occurred during track lookup.")
-            logger.warning(f"{log_prefix} Extraction failed. Code: {error_code}")
+            error_message = _EXTRACTION_ERROR_MESSAGES.get(error_code, "An unknown error occurred during track lookup.")
+            logger.warning("%s Extraction failed. Code: %s", log_prefix, error_code.value)
             await _send_dm_or_log(ctx.author, error_message)
             return
 
         if not songs_to_add:
-            logger.warning(f"{log_prefix} Extraction succeeded but found no playable songs for query: {query}")
+            logger.warning("%s Extraction succeeded but found no playable songs for query: %s", log_prefix, query)
             await _send_dm_or_log(ctx.author, f"Couldn't find any playable songs for '{query}'.")
             return
 
+        # --- Re-check the Connection ---
+        # The idle timeout can tear the state down while extraction runs; queuing onto it would silently drop the songs
+        if self.guild_states.get(ctx.guild.id) is not state or not state.voice_client or not state.voice_client.is_connected():
+            logger.info("%s Guild state was torn down or disconnected during extraction. Reconnecting.", log_prefix)
+            state = self.get_guild_state(ctx.guild.id)
+            state.last_command_channel_id = ctx.channel.id
+            if not await self._ensure_voice(ctx, state, log_prefix): return
+
         # --- Add Songs to Queue ---
-        logger.debug(f"{log_prefix} Extracted {len(songs_to_add)} songs.")
+        logger.debug("%s Extracted %s songs.", log_prefix, len(songs_to_add))
         added_count = 0; start_position = 0; was_queue_empty = False
-        async with state._lock:
-            was_queue_empty = not state.queue and not state.current_song
-            start_position = len(state.queue) + (1 if state.current_song else 0) + 1
-            state.queue.extend(songs_to_add)
-            added_count = len(songs_to_add)
-            logger.info(f"{log_prefix} Added {added_count} songs. New queue length: {len(state.queue)}")
+        was_queue_empty = state.queue.empty() and not state.current_song
+        start_position = state.queue.qsize() + (1 if state.current_song else 0) + 1
+        for song in songs_to_add:
+            state.queue.put_nowait(song)
+        added_count = len(songs_to_add)
+        logger.info("%s Added %s songs. New queue length: %s", log_prefix, added_count, state.queue.qsize())
+
+        # --- Ensure Playback Starts/Continues ---
+        # Started before any feedback is awaited so the reaction's round trip overlaps the loop picking up the song
+        if added_count > 0:
+            logger.debug("%s Ensuring playback loop is running.", log_prefix)
+            state.start_playback_loop()
+            state.prefetch_next() # Queued behind a playing song: resolve it before the current one ends
 
         # --- Send Feedback ---
         if added_count > 0:
             try:
-                if not was_queue_empty: # Send DM confirmation
+                if not was_queue_empty and not pending_songs: # Send DM confirmation (playlist summaries come from _enqueue_pending)
                     feedback_embed = nextcord.Embed(color=nextcord.Color.blue())
                     first_song = songs_to_add[0]
-                    if playlist_title and added_count > 1:
-                        feedback_embed.title = "Playlist Queued"
-                        playlist_link = query if query.startswith('http') else None
-                        playlist_desc = f"**[{playlist_title}]({playlist_link})**" if playlist_link else f"**{playlist_title}**"
-                        feedback_embed.description = f"Added **{added_count}** songs from {playlist_desc} to the server queue."
-                    elif added_count == 1:
+                    if added_count == 1:
                         feedback_embed.title = "Added to Queue"
                         feedback_embed.description = f"[{first_song.title}]({first_song.webpage_url})"
                         feedback_embed.add_field(name="Position", value=f"#{start_position}", inline=True)
-                        feedback_embed.add_field(name="Duration", value=first_song.format_duration(), inline=True)
+                        feedback_embed.add_field(name="Duration", value=first_song.duration_str, inline=True)
                     else:
                          feedback_embed.title = "Songs Queued"
                          feedback_embed.description = f"Added **{added_count}** songs to the server queue."
                     requester_name = ctx.author.display_name
                     requester_icon = ctx.author.display_avatar.url if ctx.author.display_avatar else None
                     feedback_embed.set_footer(text=f"Requested by {requester_name}", icon_url=requester_icon)
-                    await _send_dm_or_log(ctx.author, embed=feedback_embed)
-                else: # React if queue was empty
+                    self.feedback_batcher.add(ctx.author, feedback_embed)
+                elif was_queue_empty and ctx.channel.permissions_for(ctx.me).add_reactions: # React if queue was empty
                     await ctx.message.add_reaction('✅')
             except Exception as e:
-                logger.error(f"{log_prefix} Failed to send feedback DM/reaction: {e}", exc_info=True)
+                logger.error("%s Failed to send feedback DM/reaction: %s", log_prefix, e, exc_info=True)
+
+        if pending_songs:
+            state.track_enqueue_task(self.bot.loop.create_task(
+                self._enqueue_pending(ctx, state, pending_songs, playlist_title, query, added_count)
+            ))
+        logger.debug("%s Play command finished processing.", log_prefix)
+
+    async def _enqueue_pending(self, ctx: commands.Context, state: GuildMusicState, pending_songs: AsyncIterator[Song],
+                               playlist_title: Optional[str], query: str, added_count: int):
+        """Queues the rest of a playlist as its entries resolve, then DMs a single summary."""
+        log_prefix = f"[Guild {state.guild_id}] PlaylistEnqueue:"
+        async for song in pending_songs:
+            if self.guild_states.get(state.guild_id) is not state:
+                logger.info("%s Guild state was replaced or removed. Dropping the rest of '%s'.", log_prefix, playlist_title)
+                return
+            state.queue.put_nowait(song)
+            added_count += 1
+        logger.info("%s Finished queuing '%s': %s songs. Queue length: %s", log_prefix, playlist_title, added_count, state.queue.qsize())
 
-        # --- Ensure Playback Starts/Continues ---
-        if added_count > 0:
-            logger.debug(f"{log_prefix} Ensuring playback loop is running.")
-            state.start_playback_loop()
-        logger.debug(f"{log_prefix} Play command finished processing.")
+        try:
+            feedback_embed = nextcord.Embed(title="Playlist Queued", color=nextcord.Color.blue())
+            playlist_link = query if query.startswith('http') else None
+            playlist_desc = f"**[{playlist_title}]({playlist_link})**" if playlist_link else f"**{playlist_title}**"
+            feedback_embed.description = f"Added **{added_count}** song{'s' if added_count != 1 else ''} from {playlist_desc} to the server queue."
+            requester_icon = ctx.author.display_avatar.url if ctx.author.display_avatar else None
+            feedback_embed.set_footer(text=f"Requested by {ctx.author.display_name}", icon_url=requester_icon)
+            self.feedback_batcher.add(ctx.author, feedback_embed)
+        except Exception as e:
+            logger.error("%s Failed to send playlist summary DM: %s", log_prefix, e, exc_info=True)
 
     @commands.command(name='join', aliases=['connect', 'j'], help="Connects the bot to your current voice channel.")
     @commands.guild_only()
@@ -1118,64 +1549,60 @@ class MusicCog(commands.Cog, name="Music"):
                     try:
                         await current_vc.move_to(target_channel)
                         await _send_dm_or_log(ctx.author, f"Moved to {target_channel.mention}.")
-                        logger.info(f"{log_prefix} Moved VC to {target_channel.name}")
+                        logger.info("%s Moved VC to %s", log_prefix, target_channel.name)
                     except asyncio.TimeoutError:
-                         logger.error(f"{log_prefix} Timeout moving VC to {target_channel.name}")
+                         logger.error("%s Timeout moving VC to %s", log_prefix, target_channel.name)
                          await _send_dm_or_log(ctx.author, "Timed out trying to move channels.")
                     except Exception as e:
-                        logger.error(f"{log_prefix} Error moving VC to {target_channel.name}: {e}", exc_info=True)
+                        logger.error("%s Error moving VC to %s: %s", log_prefix, target_channel.name, e, exc_info=True)
                         await _send_dm_or_log(ctx.author, f"Couldn't move to your channel: {e}")
             else:
                 try:
-                    logger.info(f"{log_prefix} Attempting to connect to {target_channel.name}")
+                    logger.info("%s Attempting to connect to %s", log_prefix, target_channel.name)
                     state.voice_client = await target_channel.connect()
                     await _send_dm_or_log(ctx.author, f"Connected to {target_channel.mention}.")
-                    logger.info(f"{log_prefix} Successfully connected.")
+                    logger.info("%s Successfully connected.", log_prefix)
                     state.start_playback_loop()
                 except asyncio.TimeoutError:
-                    logger.error(f"{log_prefix} Timeout connecting to {target_channel.name}")
+                    logger.error("%s Timeout connecting to %s", log_prefix, target_channel.name)
                     await _send_dm_or_log(ctx.author, f"Timed out trying to connect to {target_channel.mention}.")
-                    if ctx.guild.id in self.guild_states: del self.guild_states[ctx.guild.id]
+                    self.remove_guild_state(ctx.guild.id)
                 except nextcord.errors.ClientException as e:
-                     logger.error(f"{log_prefix} ClientException connecting to {target_channel.name}: {e}", exc_info=True)
+                     logger.error("%s ClientException connecting to %s: %s", log_prefix, target_channel.name, e, exc_info=True)
                      await _send_dm_or_log(ctx.author, f"Error connecting: {e}")
-                     if ctx.guild.id in self.guild_states: del self.guild_states[ctx.guild.id]
+                     self.remove_guild_state(ctx.guild.id)
                 except Exception as e:
-                    logger.error(f"{log_prefix} Unexpected error connecting to {target_channel.name}: {e}", exc_info=True)
+                    logger.error("%s Unexpected error connecting to %s: %s", log_prefix, target_channel.name, e, exc_info=True)
                     await _send_dm_or_log(ctx.author, "An unexpected error occurred while trying to connect.")
-                    if ctx.guild.id in self.guild_states: del self.guild_states[ctx.guild.id]
+                    self.remove_guild_state(ctx.guild.id)
 
     @commands.command(name='leave', aliases=['disconnect', 'dc', 'stopbot'], help="Disconnects the bot from voice and clears the queue.")
     @commands.guild_only()
     async def leave_command(self, ctx: commands.Context):
         """Disconnects the bot, stops playback, and clears state."""
         if not ctx.guild: return
-        state = self.guild_states.get(ctx.guild.id)
         log_prefix = f"[Guild {ctx.guild.id}] LeaveCmd:"
-        if not state or not state.voice_client or not state.voice_client.is_connected():
-            await _send_dm_or_log(ctx.author, "I'm not connected to a voice channel.")
-            return
-        logger.info(f"{log_prefix} Received leave command from {ctx.author.name}.")
+        state = await self._require_connected(ctx, "I'm not connected to a voice channel.")
+        if state is None: return
+        logger.info("%s Received leave command from %s.", log_prefix, ctx.author.name)
         await ctx.message.add_reaction('👋')
+        # Unregistered before the (slow) cleanup, so a play finishing meanwhile gets a fresh state
+        if self.remove_guild_state(ctx.guild.id):
+            logger.info("%s GuildMusicState removed; cleaning up.", log_prefix)
         await state.cleanup()
-        if ctx.guild.id in self.guild_states:
-            del self.guild_states[ctx.guild.id]
-            logger.info(f"{log_prefix} GuildMusicState removed after cleanup.")
 
     @commands.command(name='skip', aliases=['s', 'next'], help="Skips the current song.")
     @commands.guild_only()
     async def skip_command(self, ctx: commands.Context):
         """Skips the currently playing song."""
         if not ctx.guild: return
-        state = self.guild_states.get(ctx.guild.id)
-        if not state or not state.voice_client or not state.voice_client.is_connected():
-            await _send_dm_or_log(ctx.author, "I'm not connected or playing anything.")
-            return
+        state = await self._require_connected(ctx)
+        if state is None: return
         vc = state.voice_client
         if not vc.is_playing() and not vc.is_paused():
-            await _send_dm_or_log(ctx.author, "Nothing is currently playing to skip.")
+            self.feedback_batcher.add(ctx.author, message="Nothing is currently playing to skip.")
             return
-        logger.info(f"[Guild {ctx.guild.id}] Skip command received from {ctx.author.name}.")
+        logger.info("[Guild %s] Skip command received from %s.", ctx.guild.id, ctx.author.name)
         vc.stop()
         await ctx.message.add_reaction('⏭️')
 
@@ -1184,14 +1611,12 @@ class MusicCog(commands.Cog, name="Music"):
     async def stop_command(self, ctx: commands.Context):
         """Stops the player and clears the song queue."""
         if not ctx.guild: return
-        state = self.guild_states.get(ctx.guild.id)
-        if not state or not state.voice_client or not state.voice_client.is_connected():
-            await _send_dm_or_log(ctx.author, "I'm not connected or playing anything.")
+        state = await self._require_connected(ctx)
+        if state is None: return
+        if not state.current_song and state.queue.empty():
+            self.feedback_batcher.add(ctx.author, message="Nothing to stop - the player is idle and the queue is empty.")
             return
-        if not state.current_song and not state.queue:
-            await _send_dm_or_log(ctx.author, "Nothing to stop - the player is idle and the queue is empty.")
-            return
-        logger.info(f"[Guild {ctx.guild.id}] Stop command received from {ctx.author.name}.")
+        logger.info("[Guild %s] Stop command received from %s.", ctx.guild.id, ctx.author.name)
         await state.stop_playback()
         await ctx.message.add_reaction('⏹️')
 
@@ -1200,46 +1625,36 @@ class MusicCog(commands.Cog, name="Music"):
     async def pause_command(self, ctx: commands.Context):
         """Pauses the currently playing song."""
         if not ctx.guild: return
-        state = self.guild_states.get(ctx.guild.id)
-        if not state or not state.voice_client or not state.voice_client.is_connected():
-            await _send_dm_or_log(ctx.author, "I'm not connected or playing anything.")
-            return
+        state = await self._require_connected(ctx)
+        if state is None: return
         vc = state.voice_client
         if vc.is_paused():
-            await _send_dm_or_log(ctx.author, "Playback is already paused.")
+            self.feedback_batcher.add(ctx.author, message="Playback is already paused.")
             return
         if not vc.is_playing():
-            await _send_dm_or_log(ctx.author, "Nothing is currently playing to pause.")
+            self.feedback_batcher.add(ctx.author, message="Nothing is currently playing to pause.")
             return
         vc.pause()
-        logger.info(f"[Guild {ctx.guild.id}] Pause command received from {ctx.author.name}.")
-        await ctx.message.add_reaction('⏸️')
-        if state.current_player_view:
-            state.current_player_view._update_buttons()
-            await state._update_player_message(view=state.current_player_view)
+        logger.info("[Guild %s] Pause command received from %s.", ctx.guild.id, ctx.author.name)
+        await self._ack_and_refresh_player(ctx, state, '⏸️')
 
     @commands.command(name='resume', aliases=['unpause'], help="Resumes the paused song.")
     @commands.guild_only()
     async def resume_command(self, ctx: commands.Context):
         """Resumes playback if it was paused."""
         if not ctx.guild: return
-        state = self.guild_states.get(ctx.guild.id)
-        if not state or not state.voice_client or not state.voice_client.is_connected():
-            await _send_dm_or_log(ctx.author, "I'm not connected.")
-            return
+        state = await self._require_connected(ctx, "I'm not connected.")
+        if state is None: return
         vc = state.voice_client
         if vc.is_playing():
-            await _send_dm_or_log(ctx.author, "Playback is already playing.")
+            self.feedback_batcher.add(ctx.author, message="Playback is already playing.")
             return
         if not vc.is_paused():
-            await _send_dm_or_log(ctx.author, "Nothing is currently paused.")
+            self.feedback_batcher.add(ctx.author, message="Nothing is currently paused.")
             return
         vc.resume()
-        logger.info(f"[Guild {ctx.guild.id}] Resume command received from {ctx.author.name}.")
-        await ctx.message.add_reaction('▶️')
-        if state.current_player_view:
-            state.current_player_view._update_buttons()
-            await state._update_player_message(view=state.current_player_view)
+        logger.info("[Guild %s] Resume command received from %s.", ctx.guild.id, ctx.author.name)
+        await self._ack_and_refresh_player(ctx, state, '▶️')
 
     @commands.command(name='queue', aliases=['q', 'nowplaying', 'np'], help="Shows the current song queue.")
     @commands.guild_only()
@@ -1253,6 +1668,13 @@ class MusicCog(commands.Cog, name="Music"):
          state.last_command_channel_id = ctx.channel.id
          embed = await self.build_queue_embed(state)
          if embed:
+             embed_dict = embed.to_dict()
+             now = time.monotonic()
+             last_reply = state.last_queue_reply # Kept per guild, so it goes away with the state
+             if last_reply and last_reply[0] == ctx.channel.id and now - last_reply[1] < QUEUE_REPEAT_WINDOW and last_reply[2] == embed_dict:
+                 await ctx.message.add_reaction('🔁') # Same queue was just posted here; point at it instead of repeating it
+                 return
+             state.last_queue_reply = (ctx.channel.id, now, embed_dict)
              await ctx.send(embed=embed)
          else:
              await ctx.send("The queue is empty and nothing is currently playing.")
@@ -1262,23 +1684,77 @@ class MusicCog(commands.Cog, name="Music"):
     async def volume_command(self, ctx: commands.Context, *, volume: int):
         """Sets the playback volume."""
         if not ctx.guild: return
-        state = self.guild_states.get(ctx.guild.id)
-        if not state or not state.voice_client or not state.voice_client.is_connected():
-            await _send_dm_or_log(ctx.author, "I'm not connected to voice.")
-            return
+        state = await self._require_connected(ctx, "I'm not connected to voice.")
+        if state is None: return
+        vc = state.voice_client
         if not 0 <= volume <= 100:
-            await _send_dm_or_log(ctx.author, "Please provide a volume level between 0 and 100.")
+            self.feedback_batcher.add(ctx.author, message="Please provide a volume level between 0 and 100.")
             return
         new_volume_float = volume / 100.0
+        if abs(new_volume_float - state.volume) < 1e-6:
+            await ctx.message.add_reaction('🔊') # Already at that level; nothing to change or report
+            return
         state.volume = new_volume_float
-        if state.voice_client.source and isinstance(state.voice_client.source, nextcord.PCMVolumeTransformer):
-            state.voice_client.source.volume = new_volume_float
+        if vc.source and isinstance(vc.source, nextcord.PCMVolumeTransformer):
+            vc.source.volume = new_volume_float
             await _send_dm_or_log(ctx.author, f"Volume set to **{volume}%**.")
         else:
              await _send_dm_or_log(ctx.author, f"Volume set to **{volume}%**. It will apply to the next song.")
-        logger.info(f"[Guild {ctx.guild.id}] Volume set to {volume}% by {ctx.author.name}.")
+        logger.info("[Guild %s] Volume set to %s%% by %s.", ctx.guild.id, volume, ctx.author.name)
+
+    @commands.command(name='clearcache', help="(Owner Only) Clears cached yt-dlp lookups (in memory and in Redis) and player data.")
+    @commands.is_owner()
+    async def clearcache_command(self, ctx: commands.Context):
+        """Drops the in-memory and Redis lookup caches and yt-dlp's disk cache, like yt-dlp --rm-cache-dir."""
+        self._info_cache.clear()
+        persisted_count = await redis_utils.clear_ytdl_info()
+        cache_dir_cleared = True
+        try:
+            await self.bot.loop.run_in_executor(self._ytdl_pool, self.ydl.cache.remove)
+            os.makedirs(YTDL_CACHE_DIR, exist_ok=True)
+        except Exception as e:
+            logger.error("Failed to clear yt-dlp cache dir '%s': %s", YTDL_CACHE_DIR, e, exc_info=True)
+            cache_dir_cleared = False
+
+        failed = [name for name, ok in (("the lookups persisted in Redis", persisted_count is not None),
+                                        ("the yt-dlp cache directory", cache_dir_cleared)) if not ok]
+        if failed:
+            await _send_dm_or_log(ctx.author, f"Cleared in-memory lookups, but couldn't clear {' or '.join(failed)}.")
+            return
+        logger.info("yt-dlp caches cleared by %s (%s persisted lookups).", ctx.author.name, persisted_count)
+        await _send_dm_or_log(ctx.author, f"Cleared cached lookups ({persisted_count} persisted in Redis) and the yt-dlp cache directory.")
 
     # --- Error Handler ---
+    async def _on_check_failure(self, ctx: commands.Context, error: commands.CommandError, log_prefix: str, cmd_name: str) -> Optional[str]:
+        logger.warning("%s Check failed for command '%s': %s", log_prefix, cmd_name, error)
+        return "You don't have the necessary permissions or conditions met to use this command."
+
+    async def _on_missing_argument(self, ctx: commands.Context, error: commands.CommandError, log_prefix: str, cmd_name: str) -> Optional[str]:
+        return f"Oops! You missed an argument: `{error.param.name}`. Use `?help {cmd_name}` for details."
+
+    async def _on_bad_argument(self, ctx: commands.Context, error: commands.CommandError, log_prefix: str, cmd_name: str) -> Optional[str]:
+        return f"Invalid argument provided. Use `?help {cmd_name}` for details."
+
+    async def _on_invoke_error(self, ctx: commands.Context, error: commands.CommandError, log_prefix: str, cmd_name: str) -> Optional[str]:
+        original_error = error.original
+        if isinstance(original_error, nextcord.HTTPException) and original_error.code == 50035 and 'embeds.0.fields' in str(original_error.text).lower():
+            logger.warning("%s Embed length error likely from queue display.", log_prefix)
+            await ctx.send("The queue is too long to display fully!")
+            return None
+        elif isinstance(original_error, nextcord.errors.ClientException):
+             logger.error("%s Voice ClientException during '%s': %s", log_prefix, cmd_name, original_error, exc_info=False)
+             return f"A voice-related error occurred: {original_error}"
+        logger.error("%s Error invoking command '%s': %s: %s", log_prefix, cmd_name, original_error.__class__.__name__, original_error, exc_info=original_error)
+        return _GENERIC_INVOKE_MSG.format(cmd_name)
+
+    # Keyed on base error types; cog_command_error walks the error's MRO so subclasses resolve to the nearest handler
+    _ERROR_HANDLERS = {
+        commands.CheckFailure: _on_check_failure,
+        commands.MissingRequiredArgument: _on_missing_argument,
+        commands.BadArgument: _on_bad_argument,
+        commands.CommandInvokeError: _on_invoke_error,
+    }
+
     async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
         """Handles errors specific to commands within this cog, sending feedback via DM."""
         log_prefix = f"[Guild {ctx.guild.id if ctx.guild else 'DM'}] CogCmdErrorHandler:"
@@ -1288,63 +1764,49 @@ class MusicCog(commands.Cog, name="Music"):
 
         if isinstance(error, commands.CommandNotFound): return
 
-        error_message = None
-
-        if isinstance(error, commands.CheckFailure):
-            logger.warning(f"{log_prefix} Check failed for command '{ctx.command.qualified_name if ctx.command else 'N/A'}': {error}")
-            error_message = "You don't have the necessary permissions or conditions met to use this command."
-        elif isinstance(error, commands.MissingRequiredArgument):
-            error_message = f"Oops! You missed an argument: `{error.param.name}`. Use `?help {ctx.command.qualified_name}` for details."
-        elif isinstance(error, commands.BadArgument):
-            error_message = f"Invalid argument provided. Use `?help {ctx.command.qualified_name}` for details."
-        elif isinstance(error, commands.GuildNotFound):
-             error_message = "This command can only be used in a server."
-        elif isinstance(error, commands.CommandInvokeError):
-            original_error = error.original
-            cmd_name = ctx.command.qualified_name if ctx.command else 'unknown command'
-            if isinstance(original_error, nextcord.HTTPException) and original_error.code == 50035 and 'embeds.0.fields' in str(original_error.text).lower():
-                logger.warning(f"{log_prefix} Embed length error likely from queue display.")
-                await ctx.send("The queue is too long to display fully!")
-                return
-            elif isinstance(original_error, nextcord.errors.ClientException):
-                 logger.error(f"{log_prefix} Voice ClientException during '{cmd_name}': {original_error}", exc_info=False)
-                 error_message = f"A voice-related error occurred: {original_error}"
-            else:
-                logger.error(f"{log_prefix} Error invoking command '{cmd_name}': {original_error.__class__.__name__}: {original_error}", exc_info=original_error)
-                error_message = f"An internal error occurred while running the `{cmd_name}` command. Please let the bot owner know."
+        cmd_name = ctx.command.qualified_name if ctx.command else 'unknown command'
+        handler = next((self._ERROR_HANDLERS[cls] for cls in type(error).__mro__ if cls in self._ERROR_HANDLERS), None)
+        if handler:
+            error_message = await handler(self, ctx, error, log_prefix, cmd_name)
         else:
-            cmd_name = ctx.command.qualified_name if ctx.command else 'unknown command'
-            logger.error(f"{log_prefix} Unhandled error type '{type(error).__name__}' for command '{cmd_name}': {error}", exc_info=error)
+            logger.error("%s Unhandled error type '%s' for command '%s': %s", log_prefix, type(error).__name__, cmd_name, error, exc_info=error)
             error_message = f"An unexpected error occurred: {type(error).__name__}"
 
         if error_message and ctx.author:
-            await _send_dm_or_log(ctx.author, message=error_message)
+            self.feedback_batcher.add(ctx.author, message=error_message) # Bursts of failing commands arrive as one DM
         elif error_message:
-             logger.warning(f"{log_prefix} Could not DM error message as ctx.author was not available.")
+             logger.warning("%s Could not DM error message as ctx.author was not available.", log_prefix)
 # --- End Error Handler ---
 
 # --- setup function (Keep the manual opus load version) ---
 def setup(bot: commands.Bot):
     """Adds the MusicCog to the bot."""
-    OPUS_PATH = '/usr/lib/x86_64-linux-gnu/libopus.so.0' # Confirmed path
-
     try:
         if not nextcord.opus.is_loaded():
-            logger.info(f"Opus not auto-loaded. Attempting manual load from: {OPUS_PATH}")
-            nextcord.opus.load_opus(OPUS_PATH)
-            if nextcord.opus.is_loaded():
-                 logger.info("Opus manually loaded successfully.")
-            else:
-                 logger.critical("Manual Opus load attempt finished, but is_loaded() is still false.")
+            candidates = [path for path in OPUS_PATHS if os.path.exists(path)] # Only dlopen files that are actually there
+            found = ctypes.util.find_library('opus') # One ld.so cache lookup; covers distro-specific locations
+            if found and found not in candidates:
+                candidates.insert(0, found)
+            logger.info("Opus not auto-loaded. Attempting manual load from: %s", candidates)
+            for path in candidates:
+                try:
+                    nextcord.opus.load_opus(path)
+                    logger.info("Opus manually loaded successfully from '%s'.", path)
+                    break
+                except Exception as e:
+                    logger.warning("Manual Opus load from '%s' failed: %s", path, e)
+            if not nextcord.opus.is_loaded():
+                logger.critical("CRITICAL: Manual Opus load failed (existing candidates: %s). "
+                                "Ensure libopus is installed and the library file is valid and has correct permissions inside the container.", candidates)
         else:
             logger.info("Opus library was already loaded automatically.")
 
-    except nextcord.opus.OpusNotLoaded as e:
-        logger.critical(f"CRITICAL: Manual Opus load failed using path '{OPUS_PATH}'. Error: {e}. "
-                        "Ensure the path is correct and the library file is valid and has correct permissions inside the container.")
     except Exception as e:
-         logger.critical(f"CRITICAL: An unexpected error occurred during manual Opus load attempt: {e}", exc_info=True)
+         logger.critical("CRITICAL: An unexpected error occurred during manual Opus load attempt: %s", e, exc_info=True)
 
+    if not nextcord.opus.is_loaded():
+        # Voice can't encode a single packet without Opus; refuse to load rather than fail on every play
+        raise RuntimeError("libopus could not be loaded, MusicCog cannot function.")
     bot.add_cog(MusicCog(bot))
     logger.info("MusicCog added to bot.")
 
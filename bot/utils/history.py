@@ -2,6 +2,7 @@ import redis.asyncio as redis
 import os
 import json
 import logging
+from typing import Optional
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -208,3 +209,67 @@ async def is_channel_muted(channel_id: int) -> bool:
     except Exception as e:
         logger.error(f"Unexpected error checking mute status for channel {channel_id}: {e}", exc_info=True)
         return False # Fail safe
+
+# --- yt-dlp Info Cache Functions ---
+
+async def get_ytdl_info(key: str):
+    """Retrieves a cached yt-dlp info payload (JSON string) from Redis, or None if missing or on error."""
+    redis_key = f"ytdl:{key}"
+    try:
+        redis_client = await get_redis_client()
+        payload = await redis_client.get(redis_key)
+        logger.debug(f"yt-dlp info cache {'hit' if payload else 'miss'} for {redis_key}")
+        return payload
+    except redis.RedisError as e:
+        logger.warning(f"Redis error reading yt-dlp info cache key {redis_key}: {e}")
+        return None
+    except ConnectionError as e:
+         logger.warning(f"Failed to get Redis client for reading yt-dlp info cache: {e}")
+         return None
+    except Exception as e:
+        logger.error(f"Unexpected error reading yt-dlp info cache key {redis_key}: {e}", exc_info=True)
+        return None
+
+async def set_ytdl_info(key: str, payload: str, ttl: int) -> bool:
+    """Stores a yt-dlp info payload (JSON string) in Redis, expiring after ttl seconds."""
+    redis_key = f"ytdl:{key}"
+    try:
+        redis_client = await get_redis_client()
+        result = await redis_client.set(redis_key, payload, ex=ttl)
+        logger.debug(f"Stored yt-dlp info cache key {redis_key} ({len(payload)} chars, TTL {ttl}s)")
+        return bool(result)
+    except redis.RedisError as e:
+        logger.warning(f"Redis error storing yt-dlp info cache key {redis_key}: {e}")
+        return False
+    except ConnectionError as e:
+         logger.warning(f"Failed to get Redis client for storing yt-dlp info cache: {e}")
+         return False
+    except Exception as e:
+        logger.error(f"Unexpected error storing yt-dlp info cache key {redis_key}: {e}", exc_info=True)
+        return False
+
+async def clear_ytdl_info() -> Optional[int]:
+    """Deletes every cached yt-dlp info payload from Redis. Returns the number of keys deleted, or None on error."""
+    deleted_count = 0
+    try:
+        redis_client = await get_redis_client()
+        batch = []
+        # SCAN instead of KEYS so a large cache can't block Redis for other clients
+        async for redis_key in redis_client.scan_iter(match="ytdl:*", count=500):
+            batch.append(redis_key)
+            if len(batch) >= 500:
+                deleted_count += await redis_client.delete(*batch)
+                batch.clear()
+        if batch:
+            deleted_count += await redis_client.delete(*batch)
+        logger.info(f"Cleared {deleted_count} yt-dlp info cache keys from Redis.")
+        return deleted_count
+    except redis.RedisError as e:
+        logger.error(f"Redis error clearing yt-dlp info cache after {deleted_count} keys: {e}", exc_info=True)
+        return None
+    except ConnectionError as e:
+         logger.error(f"Failed to get Redis client for clearing yt-dlp info cache: {e}")
+         return None
+    except Exception as e:
+        logger.error(f"Unexpected error clearing yt-dlp info cache: {e}", exc_info=True)
+        return None